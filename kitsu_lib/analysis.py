@@ -1,15 +1,31 @@
 """Helpers for Kitsu data analysis."""
 
-import json
-from pathlib import Path
 
 import humps
 from furl import furl
-from icecream import ic
 
 from .cache_helpers import KITSU_DATA
+from .codec_helpers import JSON_CODEC
 from .kitsu_helpers import LOGGER, rm_brs
 
+ENTRY_KEYS = ['createdAt', 'updatedAt', 'progress', 'notes', 'private', 'progressedAt', 'startedAt', 'finishedAt',
+              'ratingTwenty', 'subtype']
+"""Library entry attributes copied as-is by `merge_anime_info()`."""
+
+ANIME_KEYS = ['canonicalTitle', 'slug', 'averageRating', 'userCount', 'favoritesCount', 'startDate', 'endDate',
+              'nextRelease', 'popularityRank', 'ratingRank', 'ageRating', 'status', 'episodeCount', 'episodeLength',
+              'totalLength', 'showType']
+"""Anime attributes copied as-is by `merge_anime_info()`."""
+
+SPARSE_FIELDS = {
+    # `subtype` is an anime attribute, so requesting it for library entries would be rejected as an unknown field
+    'libraryEntries': [*[key for key in ENTRY_KEYS if key != 'subtype'], 'status', 'anime'],
+    'anime': [*ANIME_KEYS, 'posterImage', 'synopsis', 'categories', 'streamingLinks'],
+    'categories': ['slug'],
+    'streamingLinks': ['url'],
+}
+"""JSON:API sparse fieldsets with only the attributes and relationships read by `merge_anime_info()`."""
+
 
 def filter_stream_urls(streams):
     """Create a list of valid stream URLs.
@@ -41,7 +57,6 @@ def summarize_streams(streams):
 
     """
     summary = {}
-    ic_streams = ic.format(streams)
     for stream_url in filter_stream_urls(streams):
         # Create a key for each hostname
         if 'a.co/' in stream_url:
@@ -53,7 +68,7 @@ def summarize_streams(streams):
                 key += f'_{style}'
         # Add unique hostname key to the summary
         if key in summary:
-            LOGGER.warning(f'Too many streams. Overwriting {key}. Found: {ic_streams}')
+            LOGGER.warning(f'Too many streams. Overwriting {key}. Found: {streams}')
         summary[key] = stream_url
     return summary
 
@@ -92,12 +107,7 @@ def merge_anime_info(anime_entry_data, anime, streams):
     entry_attr = anime_entry_data['attributes']
     anime_attr = anime['data']['attributes']
 
-    entry_keys = ['createdAt', 'updatedAt', 'progress', 'notes', 'private', 'progressedAt', 'startedAt',
-                  'finishedAt', 'ratingTwenty', 'subtype']
-    anime_keys = ['canonicalTitle', 'slug', 'averageRating', 'userCount', 'favoritesCount', 'startDate', 'endDate',
-                  'nextRelease', 'popularityRank', 'ratingRank', 'ageRating', 'status', 'episodeCount',
-                  'episodeLength', 'totalLength', 'showType']
-    if any(key in entry_keys for key in anime_keys):
+    if any(key in ENTRY_KEYS for key in ANIME_KEYS):
         raise RuntimeError('FOUND DUPLICATE KEYS')
 
     # Combine and collapse fields of interest
@@ -110,7 +120,7 @@ def merge_anime_info(anime_entry_data, anime, streams):
         'watch_status': entry_attr['status'],
         **summarize_streams(streams),
     }
-    for attr, keys in [(entry_attr, entry_keys), (anime_attr, anime_keys)]:
+    for attr, keys in [(entry_attr, ENTRY_KEYS), (anime_attr, ANIME_KEYS)]:
         for key in keys:
             data[key] = attr[key] if key in attr else None
 
@@ -128,7 +138,7 @@ def create_kitsu_database(summary_file_path):
     table.drop()  # Clear database
 
     # Insert each entry from JSON file into the table
-    all_data = json.loads(Path(summary_file_path).read_text())
+    all_data = JSON_CODEC.load_file(summary_file_path)
     entries = []
     for entry in all_data['data']:
         # The list of categories is an unsupported type in SQL. Unwrap category and add each as a new key
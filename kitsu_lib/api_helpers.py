@@ -1,77 +1,339 @@
 """Helpers for Kitsu API requests."""
 
-import json
+import functools
+import os
 import time
 from json.decoder import JSONDecodeError
-from pathlib import Path
 
-import requests
+from requests.exceptions import HTTPError
 
-from .cache_helpers import FILE_DATA, match_url_in_cache, store_response
+from .analysis import SPARSE_FIELDS
+from .cache_helpers import (CACHE_POLICY, EXPIRED, FILE_DATA, MEMORY_CACHE, STALE, load_response,
+                            match_url_in_cache, match_urls_before, store_response, touch_response)
+from .codec_helpers import JSON_CODEC
+from .flight_helpers import BACKGROUND_REFRESH, IN_FLIGHT
 from .kitsu_helpers import LOGGER
+from .session_helpers import HTTP_SESSION
+from .throttle_helpers import CIRCUIT_BREAKER, RATE_LIMITER, RETRY_POLICY, parse_retry_after
 
+KITSU_API_URL = os.environ.get('KITSU_API_URL', 'https://kitsu.io/api/edge')
+"""Base URL of the Kitsu API. Set the `KITSU_API_URL` environment variable to use a local stand-in server."""
+
+CHUNK_SIZE = 64 * 1024
+"""Number of bytes to read at a time from the (decompressed) response stream."""
+
+MAX_LOGGED_BODY = 2000
+"""Maximum number of characters of a response body to log when the response cannot be decoded."""
+
+LIBRARY_PAGE_LIMIT = 500
+"""Largest `page[limit]` accepted by the `library-entries` endpoint (the API default is only 10 entries per page)."""
+
+ANIME_PAGE_LIMIT = 20
+"""Largest `page[limit]` accepted by the `anime` endpoint, which is the number of IDs fetched per bulk request."""
+
+LIBRARY_INCLUDE = 'anime,anime.categories,anime.streamingLinks'
+"""JSON:API `include` value to embed the anime, categories, and streams in each library page (compound document)."""
 
-def get_data(url, kwargs=None, debug=False):
-    """Return response from generic get request for data object.
+
+def decode_response(raw):
+    """Decode the JSON body of a streamed response.
+
+    The body is decompressed chunk-by-chunk from the connection and decoded directly from bytes, which skips the
+    intermediary `str` copy made by `requests.Response.text`
+
+    Args:
+        raw: `requests.Response` requested with `stream=True`
+
+    Returns:
+        dict: decoded response
+
+    Raises:
+        JSONDecodeError: if response cannot be decoded to JSON
+
+    """
+    body = b''.join(raw.iter_content(chunk_size=CHUNK_SIZE))
+    LOGGER.debug(f"Received {len(body)} bytes (Content-Encoding: {raw.headers.get('Content-Encoding', 'identity')})")
+    try:
+        return JSON_CODEC.loads(body)
+    except (JSONDecodeError, UnicodeDecodeError) as error:
+        preview = body[:MAX_LOGGED_BODY].decode('utf-8', errors='replace')
+        LOGGER.debug(f"{'=' * 80}\nFailed to parse response from: {raw.url}\n{preview}\n\n"
+                     f'({len(body)} bytes total) error:{error}')
+        if isinstance(error, JSONDecodeError):
+            raise
+        raise JSONDecodeError(str(error), preview, 0) from error
+
+
+def request_data(url, kwargs=None, debug=False, headers=None):
+    """Return the parsed and raw response from a generic get request for data object.
+
+    Every request waits on the shared `CIRCUIT_BREAKER` and `RATE_LIMITER`. Connection errors, undecodable bodies, and
+    responses in `RETRY_POLICY.retryable_status` are retried with jittered exponential backoff. Throttled responses
+    (`429`) are instead delayed by the rate limiter for the `Retry-After` duration
 
     Args:
         url: URL for request
-        kwargs: Additional arguments to pass to `requests.get()`. Default is None
+        kwargs: Query parameters to pass to `requests.Session.get()`. Default is None
         debug: if True, will print full response to log file
+        headers: optional dictionary of additional request headers, such as conditional request validators
 
     Returns:
-        dict: request response
+        tuple: `(resp, raw)` of the decoded response and the `requests.Response`. `resp` is None for a `304`
 
     Raises:
-        JSONDecodeError: if response cannot be decoded to JSON
+        HTTPError: if the response status is still retryable after the last attempt
+        Exception: any of `RETRY_POLICY.retryable_errors` (such as `JSONDecodeError`) raised on the last attempt
 
     """
     LOGGER.debug(f'get_data for: `{url}`')
     if kwargs is None:
         kwargs = {}
-    raw = requests.get(url, kwargs)
-    resp = None
-    try:
-        resp = raw.json()
-        time.sleep(0.1)
-    except JSONDecodeError as error:
-        LOGGER.debug(f"{'=' * 80}\nFailed to parse response from: {url}\n{raw.text}\n\nerror:{error}")
-        raise
+    for attempt in range(1, RETRY_POLICY.max_attempts + 1):
+        CIRCUIT_BREAKER.wait()
+        RATE_LIMITER.acquire()
+        delay = None
+        try:
+            raw = HTTP_SESSION.session.get(url, params=kwargs, headers=headers, stream=True)
+            if raw.status_code not in RETRY_POLICY.retryable_status:
+                resp = None if raw.status_code == 304 else decode_response(raw)
+                raw.close()
+                RATE_LIMITER.reward()
+                CIRCUIT_BREAKER.record_success()
+                if debug:
+                    LOGGER.debug(resp)
+                return resp, raw
+
+            raw.close()
+            error = HTTPError(f'{raw.status_code} response from: {url}', response=raw)
+            if raw.status_code == 429:
+                # The rate limiter pauses every caller for the Retry-After duration, so no additional backoff
+                RATE_LIMITER.penalize(parse_retry_after(raw.headers.get('Retry-After')))
+                delay = 0
+        except RETRY_POLICY.retryable_errors as exc:
+            error = exc
+
+        if delay is None:
+            CIRCUIT_BREAKER.record_failure()
+            delay = RETRY_POLICY.delay(attempt)
+        if attempt == RETRY_POLICY.max_attempts:
+            break
+        LOGGER.warning(f'Attempt {attempt} failed for {url} ({error}). Retrying in {delay:.2f}s')
+        time.sleep(delay)
+
+    raise error
 
-    if debug:
-        LOGGER.debug(resp)
-    return resp
 
+def get_data(url, kwargs=None, debug=False):
+    """Return response from generic get request for data object.
 
-def selective_request(prefix, url, **get_kwargs):
-    """Store the response object as a JSON file and track in a SQLite database.
+    Args:
+        url: URL for request
+        kwargs: Query parameters to pass to `requests.Session.get()`. Default is None
+        debug: if True, will print full response to log file
+
+    Returns:
+        dict: request response
+
+    """
+    return request_data(url, kwargs, debug)[0]
+
+
+def sparse_fields(*resource_types):
+    """Return the JSON:API sparse fieldset query parameters for each resource type.
+
+    Args:
+        resource_types: JSON:API resource types from `SPARSE_FIELDS` (ex: `anime`)
+
+    Returns:
+        dict: query parameters, such as `{'fields[anime]': 'canonicalTitle,slug,...'}`
+
+    """
+    return {f'fields[{resource_type}]': ','.join(SPARSE_FIELDS[resource_type]) for resource_type in resource_types}
+
+
+def add_query(url, params):
+    """Append query parameters to a URL so that they are part of the cache key.
+
+    Args:
+        url: URL with or without an existing query string
+        params: dictionary of query parameters
+
+    Returns:
+        str: URL with the additional query parameters
+
+    """
+    if not params:
+        return url
+    separator = '&' if '?' in url else '?'
+    return url + separator + '&'.join(f'{key}={value}' for key, value in params.items())
+
+
+def find_cached_row(url):
+    """Return the row of the file database for the URL if already downloaded.
 
     Args:
-        prefix: string used to create more recognizable filenames
         url: full URL to use as a reference if already downloaded
-        get_kwargs: additional keyword arguments to pass to `get_data()`
 
     Returns:
-        dict: Kitsu API response
+        dict: match object with keys of the SQL table or None if not found in the cache
 
     Raises:
         RuntimeError: if duplicates found in database
 
     """
     matches = match_url_in_cache(url)
+    if len(matches) > 1:
+        match_ids = [match['id'] for match in matches]
+        raise RuntimeError(f'Too many matches for url={url} in {FILE_DATA.database_path}. Matches: {match_ids}')
+    return matches[0] if matches else None
+
+
+def load_cached_response(url):
+    """Return the cached response for the URL if already downloaded.
+
+    Args:
+        url: full URL to use as a reference if already downloaded
+
+    Returns:
+        dict: Kitsu API response or None if not found in the cache
+
+    """
+    obj = MEMORY_CACHE.get(url)
+    if obj is not None:
+        return obj
+    row = find_cached_row(url)
+    return None if row is None else load_response(row)
+
+
+def conditional_headers(row):
+    """Return the conditional request headers for a cached response.
+
+    Args:
+        row: match object from `find_cached_row()` or None
+
+    Returns:
+        dict: `If-None-Match` and/or `If-Modified-Since` headers. Empty if there are no stored validators
+
+    """
+    headers = {}
+    if row and row.get('etag'):
+        headers['If-None-Match'] = row['etag']
+    if row and row.get('last_modified'):
+        headers['If-Modified-Since'] = row['last_modified']
+    return headers
+
+
+def response_validators(raw):
+    """Return the validators to store with a response for later conditional requests.
+
+    Args:
+        raw: `requests.Response`
+
+    Returns:
+        dict: with keys `etag` and `last_modified`
+
+    """
+    return {'etag': raw.headers.get('ETag'), 'last_modified': raw.headers.get('Last-Modified')}
+
+
+def cache_request_result(prefix, url, row, obj, raw):
+    """Store a new response or reuse the cached response when the API responded `304 Not Modified`.
+
+    Args:
+        prefix: string used to create more recognizable filenames
+        url: full URL to use as a reference if already downloaded
+        row: previously cached row from `find_cached_row()` or None
+        obj: decoded response from `request_data()`
+        raw: `requests.Response` from `request_data()`
+
+    Returns:
+        dict: Kitsu API response
+
+    Raises:
+        RuntimeError: if the API responded `304 Not Modified`, but there is no cached response
+
+    """
+    if raw.status_code == 304:
+        if row is None:
+            raise RuntimeError(f'Received 304 Not Modified for {url}, but there is no cached response to reuse')
+        LOGGER.debug(f'Not modified, reusing cached response for {url}')
+        return load_response({**row, 'timestamp': touch_response(url)})
+    store_response(prefix, url, obj, replace=row is not None, validators=response_validators(raw))
+    return obj
+
+
+def flight_key(url, revalidate):
+    """Return the `IN_FLIGHT` key for a request.
+
+    Revalidations use a separate key. Otherwise, a background refresh that is scheduled while the caller still holds
+    the key for the stale read would wait on that read and receive the stale response instead of making a request
+
+    Args:
+        url: full URL of the request
+        revalidate: True if the cached response is revalidated
+
+    Returns:
+        object: hashable key
+
+    """
+    return ('revalidate', url) if revalidate else url
+
+
+def can_use_cached(prefix, url, timestamp, get_kwargs):
+    """Check the freshness of a cached response and schedule a background refresh if it is stale.
+
+    Args:
+        prefix: string passed to `selective_request()`, which selects the TTL in `CACHE_POLICY`
+        url: full URL of the cached response
+        timestamp: time that the response was stored or last revalidated
+        get_kwargs: keyword arguments from `selective_request()` to reuse for the refresh
+
+    Returns:
+        bool: True if the cached response can be returned. False if it has expired
+
+    """
+    state = CACHE_POLICY.freshness(prefix, timestamp)
+    if state == STALE:
+        refresh = functools.partial(selective_request, prefix, url, revalidate=True, **get_kwargs)
+        BACKGROUND_REFRESH.submit(url, refresh)
+    return state != EXPIRED
+
+
+def selective_request(prefix, url, revalidate=None, **get_kwargs):
+    """Store the response object as a JSON file and track in a SQLite database.
+
+    Responses are returned from the `MEMORY_CACHE` without touching the database unless revalidating. Concurrent calls
+    for the same URL are coalesced so that only one request is made and every caller receives the same response object.
+    Stale responses (see `CachePolicy`) are returned right away and refreshed in the background, while expired
+    responses are revalidated before returning
+
+    Args:
+        prefix: string used to create more recognizable filenames
+        url: full URL to use as a reference if already downloaded
+        revalidate: if True, send a conditional request for a cached response and only download the body if modified.
+            Default is None, which uses `CACHE_POLICY.revalidate`
+        get_kwargs: additional keyword arguments to pass to `request_data()`
+
+    Returns:
+        dict: Kitsu API response
+
+    """
+    revalidate = CACHE_POLICY.revalidate if revalidate is None else revalidate
+    if not revalidate:
+        entry = MEMORY_CACHE.get_entry(url)
+        if entry is not None and can_use_cached(prefix, url, entry[1], get_kwargs):
+            return entry[0]
+
+    def fetch():
+        row = find_cached_row(url)
+        if row is not None and not revalidate and can_use_cached(prefix, url, row['timestamp'], get_kwargs):
+            return load_response(row)
 
-    obj = None
-    if len(matches) == 0:
         LOGGER.debug(f'Making new get request for {url}')
-        obj = get_data(url, **get_kwargs)
-        store_response(prefix, url, obj)
-    elif len(matches) == 1:
-        LOGGER.debug(f"Loading response from {matches[0]['filename']} for {url}")
-        obj = json.loads(Path(matches[0]['filename']).read_text())
-    else:
-        raise RuntimeError(f'Too many matches for url={url} in {FILE_DATA.database_path}. Matches: {matches}')
+        obj, raw = request_data(url, headers=conditional_headers(row), **get_kwargs)
+        return cache_request_result(prefix, url, row, obj, raw)
 
-    return obj  # noqa: R504
+    return IN_FLIGHT.run(flight_key(url, revalidate), fetch)
 
 
 def get_kitsu(endpoint, prefix='kitsu', **kwargs):
@@ -86,7 +348,7 @@ def get_kitsu(endpoint, prefix='kitsu', **kwargs):
         dict: Kitsu API response
 
     """
-    return selective_request(prefix, f'https://kitsu.io/api/edge/{endpoint}', **kwargs)
+    return selective_request(prefix, f'{KITSU_API_URL}/{endpoint}', **kwargs)
 
 
 def get_user(username):
@@ -125,47 +387,242 @@ def get_user_id(username=None):
     return int(user['data'][0]['id'])
 
 
-def get_library(user_id, is_anime=True):
+def get_library(user_id, is_anime=True, include_related=False, page_limit=LIBRARY_PAGE_LIMIT, sparse=True):
     """Get user's library. Will either be manga or anime.
 
     Args:
         user_id: Kitsu user ID
         is_anime: optional boolean if the returned library should be for anime or manga. Default is True (anime)
+        include_related: if True, request a compound document with the anime, categories, and streams of each entry
+            in the `included` array (see `LIBRARY_INCLUDE`). Only supported for anime. Default is False
+        page_limit: number of entries per page. Part of the URL, so also part of the cache key. Default is
+            `LIBRARY_PAGE_LIMIT`. Set to None to use the API default
+        sparse: if True, only request the fields used by `merge_anime_info()`. Only applied to anime. Default is True
 
     Returns:
         dict: Kitsu API response
 
+    Raises:
+        RuntimeError: if `include_related` is requested for a manga library
+
     """
     source_type = 'anime' if is_anime else 'manga'
     url = f'users/{user_id}/library-entries?filter[kind]={source_type}'
+    if page_limit:
+        url += f'&page[limit]={page_limit}'
+    if include_related:
+        if not is_anime:
+            raise RuntimeError('Compound library documents are only supported for anime (manga have no streams)')
+        url += f'&include={LIBRARY_INCLUDE}'
+    if sparse and is_anime:
+        resource_types = ['libraryEntries']
+        if include_related:
+            resource_types.extend(['anime', 'categories', 'streamingLinks'])
+        url = add_query(url, sparse_fields(*resource_types))
     return get_kitsu(url, prefix='library')
 
 
-def get_anime(anime_link):
+def index_included(response):
+    """Index the `included` array of a compound document by resource type and ID.
+
+    Args:
+        response: Kitsu API response requested with an `include` parameter
+
+    Returns:
+        dict: included resources keyed by `(type, id)`
+
+    """
+    return {(resource['type'], resource['id']): resource for resource in response.get('included', [])}
+
+
+def get_included(included_index, resource, relationship):
+    """Return the included resources for a to-many relationship of a resource.
+
+    Args:
+        included_index: dictionary from `index_included()`
+        resource: resource object with a `relationships` key
+        relationship: name of the relationship (ex: `categories`)
+
+    Returns:
+        list: included resource objects in relationship order
+
+    Raises:
+        KeyError: if the relationship data or any referenced resource was not included
+
+    """
+    return [included_index[(ref['type'], ref['id'])] for ref in resource['relationships'][relationship]['data']]
+
+
+def split_library_entry(anime_entry, included_index):
+    """Resolve a library entry's anime and streams from the compound document of the library page.
+
+    Args:
+        anime_entry: entry from within a library response requested with `include_related=True`
+        included_index: dictionary from `index_included()` for the same library page
+
+    Returns:
+        tuple: `(anime, streams)` in the same shape as returned by `get_anime()` and `get_streams()`
+
+    Raises:
+        KeyError: if the anime or any of the related resources were not included
+
+    """
+    ref = anime_entry['relationships']['anime']['data']
+    if ref is None:
+        raise KeyError(f"No anime relationship data for library entry {anime_entry['id']}")
+    anime_data = included_index[(ref['type'], ref['id'])]
+    anime = {'data': anime_data, 'included': get_included(included_index, anime_data, 'categories')}
+    streams = {'data': get_included(included_index, anime_data, 'streamingLinks')}
+    return anime, streams
+
+
+def anime_url(anime_link, sparse=True):
+    """Return the full anime URL with the categories included.
+
+    Args:
+        anime_link: URL to the anime. Typically from `relationships:anime:links:related`
+        sparse: if True, only request the fields used by `merge_anime_info()`. Default is True
+
+    Returns:
+        str: URL to request and use as the cache key
+
+    """
+    params = {'include': 'categories', **(sparse_fields('anime', 'categories') if sparse else {})}
+    return add_query(anime_link, params)
+
+
+def streams_url(stream_link, sparse=True):
+    """Return the full streams URL.
+
+    Args:
+        stream_link: URL to fetch available streams. Typically from `relationships:streamingLinks:links:related`
+        sparse: if True, only request the fields used by `merge_anime_info()`. Default is True
+
+    Returns:
+        str: URL to request and use as the cache key
+
+    """
+    return add_query(stream_link, sparse_fields('streamingLinks') if sparse else {})
+
+
+def get_anime(anime_link, sparse=True):
     """Get anime response from Kitsu API.
 
     `anime_link = lib_entry['data'][0]['relationships']['anime']['links']['related']`
 
     Args:
         anime_link: URL to the anime. Typically from `relationships:anime:links:related`
+        sparse: if True, only request the fields used by `merge_anime_info()`. Default is True
 
     Returns:
         dict: Kitsu API response
 
     """
-    return selective_request('anime', anime_link, kwargs={'include': 'categories'})
+    return selective_request('anime', anime_url(anime_link, sparse))
 
 
-def get_streams(stream_link):
+def get_streams(stream_link, sparse=True):
     """Get list of streams from Kitsu API.
 
     `stream_link = anime['data']['relationships']['streamingLinks']['links']['related']`
 
     Args:
         stream_link: URL to fetch available streams. Typically from `relationships:streamingLinks:links:related`
+        sparse: if True, only request the fields used by `merge_anime_info()`. Default is True
 
     Returns:
         dict: Kitsu API response
 
     """
-    return selective_request('streams', stream_link)
+    return selective_request('streams', streams_url(stream_link, sparse))
+
+
+def get_anime_by_id(anime_id, sparse=True):
+    """Get anime response from Kitsu API by the anime ID. Shares the cache entries written by `get_anime_many()`.
+
+    Args:
+        anime_id: Kitsu anime ID
+        sparse: if True, only request the fields used by `merge_anime_info()`. Default is True
+
+    Returns:
+        dict: Kitsu API response
+
+    """
+    return selective_request('anime', anime_url(f'{KITSU_API_URL}/anime/{anime_id}', sparse))
+
+
+def get_anime_many(anime_ids, sparse=True, refresh=False, urls_by_id=None):
+    """Get the anime responses for many IDs with `filter[id]` requests of up to `ANIME_PAGE_LIMIT` IDs each.
+
+    Each anime is split from the bulk response and cached under the same URL used by `get_anime_by_id()` and under any
+    additional URLs in `urls_by_id`. The ETag of the bulk response does not match the response for a single anime, so
+    only the `Last-Modified` validator is stored
+
+    Args:
+        anime_ids: iterable of Kitsu anime IDs
+        sparse: if True, only request the fields used by `merge_anime_info()`. Default is True
+        refresh: if True, fetch every ID and replace the cached responses. Default is False (only fetch missing IDs)
+        urls_by_id: optional dictionary of anime ID to a list of other URLs for the same response, such as the
+            `library-entries/{id}/anime` URLs requested by `get_anime()`
+
+    Returns:
+        dict: Kitsu API responses keyed by the string anime ID. IDs not returned by the API are omitted
+
+    """
+    urls_by_id = urls_by_id or {}
+    anime_by_id = {}
+    missing_ids = []
+    for anime_id in dict.fromkeys(str(anime_id) for anime_id in anime_ids):
+        obj = None if refresh else load_cached_response(anime_url(f'{KITSU_API_URL}/anime/{anime_id}', sparse))
+        if obj is None:
+            missing_ids.append(anime_id)
+        else:
+            anime_by_id[anime_id] = obj
+
+    for idx in range(0, len(missing_ids), ANIME_PAGE_LIMIT):
+        batch_ids = missing_ids[idx:idx + ANIME_PAGE_LIMIT]
+        params = {'filter[id]': ','.join(batch_ids), 'page[limit]': len(batch_ids)}
+        response, raw = request_data(anime_url(add_query(f'{KITSU_API_URL}/anime', params), sparse))
+        validators = {**response_validators(raw), 'etag': None}
+        included_index = index_included(response)
+        for anime_data in response['data']:
+            anime = {'data': anime_data, 'included': get_included(included_index, anime_data, 'categories')}
+            url = anime_url(f"{KITSU_API_URL}/anime/{anime_data['id']}", sparse)
+            for url in dict.fromkeys([url, *urls_by_id.get(anime_data['id'], [])]):
+                store_response('anime', url, anime, replace=True, validators=validators)
+            anime_by_id[anime_data['id']] = anime
+        LOGGER.debug(f'Fetched {len(response["data"])} of {len(batch_ids)} anime in one request')
+
+    return anime_by_id
+
+
+def refresh_stale_anime(sparse=True):
+    """Refresh every cached anime response that is past its TTL with bulk `get_anime_many()` requests.
+
+    Refreshing the cached `library-entries/{id}/anime` responses up front replaces two requests per stale anime
+    (a 304 and the background refresh) with one request per `ANIME_PAGE_LIMIT` anime. Cached responses without an
+    anime (such as error documents) are skipped
+
+    Args:
+        sparse: if True, refresh the sparse responses requested by default. Default is True
+
+    Returns:
+        int: number of refreshed URLs
+
+    """
+    ttl = CACHE_POLICY.ttl.get('anime', CACHE_POLICY.ttl.get('*'))
+    if ttl is None:
+        return 0
+    urls_by_id = {}
+    for row in match_urls_before(f'%/anime{anime_url("", sparse)}', time.time() - ttl):
+        obj = load_response(row)
+        anime_data = obj.get('data') if isinstance(obj, dict) else None
+        if not isinstance(anime_data, dict) or 'id' not in anime_data:
+            LOGGER.debug(f"Skipping stale response without an anime: {row['url']}")
+            continue
+        urls_by_id.setdefault(anime_data['id'], []).append(row['url'])
+    count = sum(len(urls) for urls in urls_by_id.values())
+    if count:
+        LOGGER.info(f'Refreshing {count} stale anime responses')
+        get_anime_many([*urls_by_id], sparse=sparse, refresh=True, urls_by_id=urls_by_id)
+    return count
@@ -0,0 +1,98 @@
+"""Asyncio variants of the Kitsu API request helpers.
+
+Only the network request is run in the event loop's executor. Cache lookups and writes run on the event loop thread,
+but stale responses are refreshed by `BACKGROUND_REFRESH`, which runs `selective_request()` on worker threads. This is
+safe because each thread has its own SQLite connection and `FILE_DATA.lock` serializes access to the cache
+
+"""
+
+import asyncio
+import functools
+
+from .api_helpers import (anime_url, cache_request_result, can_use_cached, conditional_headers, find_cached_row,
+                          flight_key, request_data, streams_url)
+from .cache_helpers import CACHE_POLICY, MEMORY_CACHE, load_response
+from .flight_helpers import IN_FLIGHT
+from .kitsu_helpers import LOGGER
+
+
+async def _request_data_async(url, semaphore=None, **get_kwargs):
+    """Run `request_data()` in the event loop's executor.
+
+    Args:
+        url: URL for request
+        semaphore: optional `asyncio.Semaphore` to limit the number of concurrent requests
+        get_kwargs: additional keyword arguments to pass to `request_data()`
+
+    Returns:
+        tuple: `(resp, raw)` from `request_data()`
+
+    """
+    loop = asyncio.get_running_loop()
+    request = functools.partial(request_data, url, **get_kwargs)
+    if semaphore is None:
+        return await loop.run_in_executor(None, request)
+    async with semaphore:
+        return await loop.run_in_executor(None, request)
+
+
+async def selective_request_async(prefix, url, semaphore=None, revalidate=None, **get_kwargs):
+    """Asyncio variant of `selective_request()`.
+
+    Args:
+        prefix: string used to create more recognizable filenames
+        url: full URL to use as a reference if already downloaded
+        semaphore: optional `asyncio.Semaphore` to limit the number of concurrent requests
+        revalidate: if True, send a conditional request for a cached response. Default is `CACHE_POLICY.revalidate`
+        get_kwargs: additional keyword arguments to pass to `request_data()`
+
+    Returns:
+        dict: Kitsu API response
+
+    """
+    revalidate = CACHE_POLICY.revalidate if revalidate is None else revalidate
+    if not revalidate:
+        entry = MEMORY_CACHE.get_entry(url)
+        if entry is not None and can_use_cached(prefix, url, entry[1], get_kwargs):
+            return entry[0]
+
+    async def fetch():
+        row = find_cached_row(url)
+        if row is not None and not revalidate and can_use_cached(prefix, url, row['timestamp'], get_kwargs):
+            return load_response(row)
+
+        LOGGER.debug(f'Making new async get request for {url}')
+        obj, raw = await _request_data_async(url, semaphore, headers=conditional_headers(row), **get_kwargs)
+        return cache_request_result(prefix, url, row, obj, raw)
+
+    return await IN_FLIGHT.run_async(flight_key(url, revalidate), fetch)
+
+
+async def get_anime_async(anime_link, semaphore=None, sparse=True):
+    """Asyncio variant of `get_anime()`.
+
+    Args:
+        anime_link: URL to the anime. Typically from `relationships:anime:links:related`
+        semaphore: optional `asyncio.Semaphore` to limit the number of concurrent requests
+        sparse: if True, only request the fields used by `merge_anime_info()`. Default is True
+
+    Returns:
+        dict: Kitsu API response
+
+    """
+    return await selective_request_async('anime', anime_url(anime_link, sparse), semaphore)
+
+
+async def get_streams_async(stream_link, semaphore=None, sparse=True):
+    """Asyncio variant of `get_streams()`.
+
+    Args:
+        stream_link: URL to fetch available streams. Typically from `relationships:streamingLinks:links:related`
+        semaphore: optional `asyncio.Semaphore` to limit the number of concurrent requests
+        sparse: if True, only request the fields used by `merge_anime_info()`. Default is True
+
+    Returns:
+        dict: Kitsu API response
+
+    """
+    return await selective_request_async('streams', streams_url(stream_link, sparse), semaphore)
@@ -24,25 +24,93 @@ table.update(dict(name='John Doe', age=47), ['name'])
 
 """
 
-import json
+import atexit
+import os
+import threading
 import time
+from collections import OrderedDict
+from contextlib import contextmanager
 from pathlib import Path
 
 import dataset
 from dash_charts.dash_helpers import uniq_table_id
+from sqlalchemy import LargeBinary, event
+from sqlalchemy.pool import StaticPool
 
+from .codec_helpers import JSON_CODEC
+from .compression_helpers import CACHE_COMPRESSOR
 from .kitsu_helpers import LOGGER
 
-CACHE_DIR = Path(__file__).parent / 'local_cache'
-"""Path to folder with all downloaded responses from Kitsu API."""
+STORAGE_MODES = ['blob', 'files']
+"""Supported storage backends for new cached responses. See `CachePolicy.storage`."""
+
+DEFAULT_TTL = {
+    'user': 7 * 24 * 3600,
+    'library': 3600,
+    'library-next': 3600,
+    'anime': 7 * 24 * 3600,
+    'streams': 24 * 3600,
+    '*': None,
+}
+"""Seconds that a cached response is fresh for each `selective_request()` prefix. `*` applies to any other prefix.
+
+A value of None never expires
+"""
+
+FRESH, STALE, EXPIRED = 'fresh', 'stale', 'expired'
+"""Freshness states returned by `CachePolicy.freshness()`."""
+
+CACHE_DIR = Path(os.environ.get('KITSU_CACHE_DIR', Path(__file__).parent / 'local_cache')).resolve()
+"""Path to folder with all downloaded responses from Kitsu API. Override with the `KITSU_CACHE_DIR` variable."""
+
+RESPONSE_DIR = CACHE_DIR / 'responses'
+"""Path to the folder of responses cached as files. Kept separate from the databases for `reconcile_files()`."""
+
+DELETE_BATCH_SIZE = 500
+"""Maximum number of rows deleted per statement (SQLite limits the number of bound parameters)."""
+
+ORPHAN_MIN_AGE = 60
+"""Seconds since a file in `RESPONSE_DIR` was modified before `reconcile_files()` can remove it for having no row."""
+
+DEFAULT_BATCH_ROWS = 100
+"""Default number of rows committed per transaction by `WriteBatch.batched()`."""
+
+DEFAULT_PRAGMAS = {
+    'journal_mode': 'wal',
+    'synchronous': 'normal',
+    'busy_timeout': 5000,
+    'cache_size': -16 * 1024,
+    'mmap_size': 256 * 1024 * 1024,
+    'temp_store': 'memory',
+}
+"""SQLite pragmas applied to each new connection by `DBConnect`. See: https://www.sqlite.org/pragma.html
+
+With the WAL journal, readers (such as the Dash app) do not block the scraper's writes and vice versa.
+`synchronous=normal` is safe from corruption in WAL mode and only risks the last commits on power loss. A negative
+`cache_size` is in KiB. Set a pragma to None in `DBConnect(pragmas=...)` to keep the SQLite default
+"""
 
 
 class DBConnect:
-    """Manage database connection since closing connection isn't possible."""
+    """Manage database connection since closing connection isn't possible.
+
+    By default, `dataset` opens a separate connection in each thread. With `shared=True`, a single connection is shared
+    by all threads, so callers that may run concurrently must hold `lock`
+
+    """
 
     database_path = None
     """Path to the local storage SQLite database file. Initialize in `__init__()`."""
 
+    pragmas = None
+    """Dictionary of SQLite pragmas applied to each new connection. Initialize in `__init__()`."""
+
+    lock = None
+    """Reentrant lock to serialize access to the database from concurrent threads. Initialize in `__init__()`."""
+
+    shared = False
+    """If True, all threads share a single SQLite connection. Initialize in `__init__()`."""
+
     _db = None
 
     @property
@@ -53,29 +121,417 @@ class DBConnect:
             dict: `dataset` database instance
 
         """
-        if self._db is None:
-            LOGGER.debug(f'Initializing dataset instance for {self.database_path}')
-            self._db = dataset.connect(f'sqlite:///{self.database_path}')
+        with self.lock:
+            if self._db is None:
+                LOGGER.debug(f'Initializing dataset instance for {self.database_path}')
+                engine_kwargs = {}
+                if self.shared:
+                    # A connection per thread would be garbage collected on another thread once its worker finishes,
+                    #   where SQLAlchemy's rollback fails the SQLite same-thread check. Each thread still gets its own
+                    #   wrapper from dataset, so returning one must not roll back the transaction of another thread
+                    engine_kwargs = {'poolclass': StaticPool, 'pool_reset_on_return': None,
+                                     'connect_args': {'check_same_thread': False}}
+                self._db = dataset.connect(f'sqlite:///{self.database_path}', engine_kwargs=engine_kwargs)
+                # dataset connects lazily, so the listener is registered before the first connection
+                event.listen(self._db.engine, 'connect', self.apply_pragmas)
         return self._db
 
-    def __init__(self, database_path):
+    def __init__(self, database_path, pragmas=None, shared=False):
         """Store the database path and ensure the parent directory exists.
 
         Args:
             database_path: path to the SQLite file
+            pragmas: optional dictionary of SQLite pragmas that override `DEFAULT_PRAGMAS`
+            shared: if True, share a single connection between threads, which must hold `lock`. Default is False
 
         """
+        self.shared = shared
+        self.pragmas = {**DEFAULT_PRAGMAS, **(pragmas or {})}
         self.database_path = database_path.resolve()
         self.database_path.parent.mkdir(exist_ok=True)
+        self.lock = threading.RLock()
+
+    def apply_pragmas(self, dbapi_connection, connection_record):
+        """Apply `pragmas` to a new SQLite connection. Called by the SQLAlchemy `connect` event.
+
+        Args:
+            dbapi_connection: `sqlite3.Connection`
+            connection_record: SQLAlchemy connection record (unused)
+
+        """
+        cursor = dbapi_connection.cursor()
+        for name, value in self.pragmas.items():
+            if value is not None:
+                cursor.execute(f'PRAGMA {name}={value}')
+        LOGGER.debug(f'Applied SQLite pragmas to {self.database_path}: {self.pragmas}')
+        cursor.close()
+
+
+class CachePolicy:
+    """Settings that control how responses are cached and when they can be reused without contacting the API.
+
+    A cached response is fresh for `ttl[prefix]` seconds. After that, it is stale for `stale_while_revalidate` seconds,
+    during which it is still returned right away while a background refresh updates it. Older responses are expired
+    and are revalidated before they are returned
+
+    """
+
+    revalidate = False
+    """If True, cached responses are revalidated with conditional requests (`If-None-Match`/`If-Modified-Since`)."""
+
+    storage = 'blob'
+    """Backend for new responses. `blob` stores the body in the lookup database and `files` writes one file each.
+
+    Responses are always read from whichever backend they were stored in, so the setting can be changed at any time
+    """
+
+    ttl = None
+    """Dictionary of prefix to seconds that a response is fresh. Initialized from `DEFAULT_TTL` in `__init__()`."""
+
+    stale_while_revalidate = 24 * 3600
+    """Seconds after the TTL that a stale response is returned while refreshing. Use `math.inf` for no limit."""
+
+    def __init__(self, revalidate=False, storage='blob', ttl=None, stale_while_revalidate=24 * 3600):
+        """Store the cache policy settings.
+
+        Args:
+            revalidate: if True, revalidate cached responses before use. Default is False
+            storage: backend for new responses (one of `STORAGE_MODES`). Default is `blob`
+            ttl: optional dictionary of prefix to seconds that override `DEFAULT_TTL`
+            stale_while_revalidate: seconds after the TTL that a stale response is served. Default is one day
+
+        """
+        self.ttl = {**DEFAULT_TTL}
+        self.configure(revalidate=revalidate, storage=storage, ttl=ttl, stale_while_revalidate=stale_while_revalidate)
+
+    def configure(self, revalidate=None, storage=None, ttl=None, stale_while_revalidate=None):
+        """Update the cache policy. Arguments left as None are unchanged.
+
+        Args:
+            revalidate: if True, revalidate cached responses before use
+            storage: backend for new responses (one of `STORAGE_MODES`)
+            ttl: dictionary of prefix to seconds (or None to never expire) to merge into the current `ttl`
+            stale_while_revalidate: seconds after the TTL that a stale response is served
+
+        Raises:
+            RuntimeError: if the storage backend is not supported
+
+        """
+        if revalidate is not None:
+            self.revalidate = revalidate
+        if storage is not None:
+            if storage not in STORAGE_MODES:
+                raise RuntimeError(f'Unknown storage `{storage}`. Expected one of: {STORAGE_MODES}')
+            self.storage = storage
+        if ttl is not None:
+            self.ttl.update(ttl)
+        if stale_while_revalidate is not None:
+            self.stale_while_revalidate = stale_while_revalidate
+
+    def freshness(self, prefix, timestamp):
+        """Return the freshness state of a cached response.
+
+        Args:
+            prefix: prefix passed to `selective_request()` (ex: `anime`)
+            timestamp: time that the response was stored or last revalidated
+
+        Returns:
+            str: one of `FRESH`, `STALE`, or `EXPIRED`
+
+        """
+        ttl = self.ttl.get(prefix, self.ttl.get('*'))
+        if ttl is None:
+            return FRESH
+        age = time.time() - (timestamp or 0)
+        if age <= ttl:
+            return FRESH
+        return STALE if age <= ttl + self.stale_while_revalidate else EXPIRED
+
+
+CACHE_POLICY = CachePolicy()
+"""Global instance of the CachePolicy() used by `selective_request()`."""
+
+
+class MemoryCache:
+    """Thread-safe, bounded LRU of decoded responses kept in front of the SQLite cache.
+
+    The size of each entry is approximated by the length of its encoded JSON. Cached objects are shared between
+    callers, so they must be treated as read-only
+
+    """
+
+    max_entries = 4096
+    """Maximum number of responses to keep. Set to 0 to disable the memory cache."""
+
+    max_bytes = 64 * 1024 * 1024
+    """Maximum total encoded size of the responses to keep."""
+
+    def __init__(self, max_entries=4096, max_bytes=64 * 1024 * 1024):
+        """Initialize an empty cache.
 
+        Args:
+            max_entries: maximum number of responses to keep. Default is 4096
+            max_bytes: maximum total encoded size of the responses. Default is 64 MiB
+
+        """
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.configure(max_entries=max_entries, max_bytes=max_bytes)
 
-FILE_DATA = DBConnect(CACHE_DIR / '_file_lookup_database.db')
-"""Global instance of the DBConnect() for the file lookup database."""
+    @property
+    def stats(self):
+        """Return the hit/miss statistics and current size.
+
+        Returns:
+            dict: counts of hits, misses, evictions, entries, and bytes
+
+        """
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses, 'evictions': self.evictions,
+                    'entries': len(self._entries), 'bytes': self._bytes}
+
+    def configure(self, max_entries=None, max_bytes=None):
+        """Update the size limits and evict entries as needed. Arguments left as None are unchanged.
+
+        Args:
+            max_entries: maximum number of responses to keep
+            max_bytes: maximum total encoded size of the responses
+
+        """
+        with self._lock:
+            self.max_entries = self.max_entries if max_entries is None else max_entries
+            self.max_bytes = self.max_bytes if max_bytes is None else max_bytes
+            self._evict()
+
+    def _evict(self):
+        """Remove the least recently used entries until within the limits. Must be called with the lock held."""
+        while self._entries and (len(self._entries) > self.max_entries or self._bytes > self.max_bytes):
+            _key, (_obj, size, _timestamp) = self._entries.popitem(last=False)
+            self._bytes -= size
+            self.evictions += 1
+
+    def get_entry(self, key):
+        """Return the cached response with the time it was stored and mark it as recently used.
+
+        Args:
+            key: cache key (the URL)
+
+        Returns:
+            tuple: `(obj, timestamp)` or None if not cached
+
+        """
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(key)
+            self.hits += 1
+            return entry[0], entry[2]
+
+    def get(self, key):
+        """Return the cached response and mark it as recently used.
+
+        Args:
+            key: cache key (the URL)
+
+        Returns:
+            dict: decoded response or None if not cached
+
+        """
+        entry = self.get_entry(key)
+        return None if entry is None else entry[0]
+
+    def put(self, key, obj, size, timestamp=None):
+        """Add or replace a response.
+
+        Args:
+            key: cache key (the URL)
+            obj: decoded response
+            size: approximate size in bytes (typically the length of the encoded JSON)
+            timestamp: time that the response was stored or revalidated. Default is now
+
+        """
+        with self._lock:
+            self._discard(key)
+            if self.max_entries <= 0 or size > self.max_bytes:
+                return
+            self._entries[key] = (obj, size, time.time() if timestamp is None else timestamp)
+            self._bytes += size
+            self._evict()
+
+    def _discard(self, key):
+        """Remove an entry if present. Must be called with the lock held.
+
+        Args:
+            key: cache key (the URL)
+
+        """
+        entry = self._entries.pop(key, None)
+        if entry is not None:
+            self._bytes -= entry[1]
+
+    def discard(self, key):
+        """Remove an entry if present.
+
+        Args:
+            key: cache key (the URL)
+
+        """
+        with self._lock:
+            self._discard(key)
+
+    def clear(self):
+        """Remove all entries and reset the statistics."""
+        with self._lock:
+            self._entries.clear()
+            self._bytes = 0
+            self.hits = self.misses = self.evictions = 0
+
+
+MEMORY_CACHE = MemoryCache()
+"""Global instance of the MemoryCache() checked by `selective_request()` before the SQLite cache."""
+
+FILE_DATA = DBConnect(CACHE_DIR / '_file_lookup_database.db', shared=True)
+"""Global instance of the DBConnect() for the file lookup database. Used by worker threads, so `shared=True`."""
 
 KITSU_DATA = DBConnect(CACHE_DIR / '_kitsu_data.db')
 """Global instance of the DBConnect() for the output for the Kitsu API parser."""
 
 
+class WriteBatch:
+    """Buffer new rows of the file database so that many cached responses are committed in a single transaction.
+
+    Batching is disabled when `max_rows` is 0, so each row is committed by `store_response()`. Buffered rows are
+    returned by `match_url_in_cache()` before they are committed. Files are always written before their row is added,
+    so a crash can lose buffered rows, but never leaves a row for a missing or partially written file
+
+    """
+
+    max_rows = 0
+    """Number of buffered rows that triggers a commit. Set to 0 to commit each row right away."""
+
+    max_delay = 1.0
+    """Seconds after the first buffered row that the next write triggers a commit."""
+
+    def __init__(self, max_rows=0, max_delay=1.0):
+        """Initialize an empty buffer.
+
+        Args:
+            max_rows: number of buffered rows that triggers a commit. Default is 0 (no batching)
+            max_delay: seconds after the first buffered row that the next write triggers a commit. Default is 1
+
+        """
+        self.rows = {}
+        self.stale_files = []
+        self._started = None
+        self.configure(max_rows=max_rows, max_delay=max_delay)
+
+    def configure(self, max_rows=None, max_delay=None):
+        """Update the batch settings. Arguments left as None are unchanged.
+
+        Disabling batching commits any buffered rows
+
+        Args:
+            max_rows: number of buffered rows that triggers a commit. Set to 0 to commit each row right away
+            max_delay: seconds after the first buffered row that the next write triggers a commit
+
+        """
+        self.max_rows = self.max_rows if max_rows is None else max_rows
+        self.max_delay = self.max_delay if max_delay is None else max_delay
+        if not self.max_rows:
+            self.flush()
+
+    @contextmanager
+    def batched(self, max_rows=DEFAULT_BATCH_ROWS):
+        """Temporarily enable batching, then commit the remaining rows and restore the previous setting.
+
+        Args:
+            max_rows: number of buffered rows that triggers a commit. Default is `DEFAULT_BATCH_ROWS`
+
+        Yields:
+            WriteBatch: this instance
+
+        """
+        previous = self.max_rows
+        self.configure(max_rows=max_rows)
+        try:
+            yield self
+        finally:
+            self.configure(max_rows=previous)
+            self.flush()
+
+    def find(self, url):
+        """Return the buffered row for the URL or the committed row if there is no buffered row.
+
+        Args:
+            url: full URL of the cached response
+
+        Returns:
+            dict: row of the file database or None if not found
+
+        """
+        with FILE_DATA.lock:
+            row = self.rows.get(url)
+            return row if row is not None else FILE_DATA.db.load_table('files').find_one(url=url)
+
+    def write(self, row, existing=None):
+        """Commit the row or add it to the buffer. The file of the replaced row is removed once it is unreferenced.
+
+        Args:
+            row: new row of the file database
+            existing: optional row for the same URL returned by `find()`
+
+        """
+        with FILE_DATA.lock:
+            stale_filename = existing['filename'] if existing is not None else None
+            if not self.max_rows:
+                FILE_DATA.db.load_table('files').upsert(row, ['url'])
+                if stale_filename:
+                    remove_files([stale_filename])
+                return
+
+            if stale_filename and existing is self.rows.get(row['url']):
+                remove_files([stale_filename])  # The buffered row was never committed
+            elif stale_filename:
+                self.stale_files.append(stale_filename)
+            self.rows[row['url']] = row
+            self._started = self._started or time.monotonic()
+            if len(self.rows) >= self.max_rows or time.monotonic() - self._started >= self.max_delay:
+                self.flush()
+
+    def flush(self):
+        """Commit all buffered rows in a single transaction, then remove the files of the replaced rows.
+
+        Returns:
+            int: number of committed rows
+
+        """
+        with FILE_DATA.lock:
+            if not self.rows:
+                return 0
+            rows = [*self.rows.values()]
+            table = FILE_DATA.db.load_table('files')
+            with FILE_DATA.db:
+                for row in rows:
+                    table.upsert(row, ['url'])
+            LOGGER.debug(f'Committed {len(rows)} buffered row(s) to {FILE_DATA.database_path}')
+            stale_files = self.stale_files
+            self.rows, self.stale_files, self._started = {}, [], None
+        remove_files(stale_files)
+        return len(rows)
+
+
+WRITE_BATCH = WriteBatch()
+"""Global instance of the WriteBatch() used by `store_response()`. Buffered rows are committed on exit."""
+
+atexit.register(WRITE_BATCH.flush)
+
+
 def pretty_dump_json(filename, obj):
     """Write indented JSON file.
 
@@ -85,21 +541,187 @@ def pretty_dump_json(filename, obj):
 
     """
     LOGGER.debug(f'Creating file: {filename}')
-    Path(filename).write_text(json.dumps(obj, indent=4, separators=(',', ': ')))
+    JSON_CODEC.dump_file(filename, obj, indent=True)
+
+
+def remove_files(filenames):
+    """Delete cached files, ignoring any that were already removed.
+
+    Args:
+        filenames: iterable of Paths or plain string filenames
+
+    """
+    for filename in filenames:
+        try:
+            Path(filename).unlink()
+        except FileNotFoundError:
+            LOGGER.debug(f'Already removed: {filename}')
+
+
+def write_file_atomic(filename, payload):
+    """Write the file under a temporary name, then rename it so that the file is either complete or missing.
+
+    Args:
+        filename: Path or plain string filename to write
+        payload: bytes to write
+
+    """
+    temporary = f'{filename}.tmp'
+    with open(temporary, 'wb') as file_handle:
+        file_handle.write(payload)
+        file_handle.flush()
+        os.fsync(file_handle.fileno())
+    os.replace(temporary, filename)
+
+
+def remove_duplicate_urls(table):
+    """Keep only the most recent row for each URL so that a unique index can be created on older caches.
+
+    Args:
+        table: `dataset` table for the file database
+
+    """
+    query = f'SELECT url FROM {table.name} GROUP BY url HAVING COUNT(*) > 1'  # noqa: S608
+    for duplicate in [*FILE_DATA.db.query(query)]:
+        stale_rows = [*table.find(url=duplicate['url'], order_by='-timestamp')][1:]
+        LOGGER.debug(f"Removing {len(stale_rows)} duplicate row(s) for {duplicate['url']}")
+        table.delete(id=[row['id'] for row in stale_rows])
+        remove_files(row['filename'] for row in stale_rows if row['filename'])
+
+
+def remove_orphans(filenames):
+    """Remove files that no row points to, skipping any file modified within `ORPHAN_MIN_AGE`.
+
+    A recent file may belong to a `store_response()` call that wrote the file, but has not added the row yet
+
+    Args:
+        filenames: list of paths in `RESPONSE_DIR` without a row
+
+    """
+    cutoff = time.time() - ORPHAN_MIN_AGE
+    orphans = []
+    for filename in filenames:
+        try:
+            if os.stat(filename).st_mtime < cutoff:
+                orphans.append(filename)
+        except FileNotFoundError:
+            pass
+    LOGGER.debug(f'Removing {len(orphans)} file(s) without a row from {RESPONSE_DIR}')
+    remove_files(orphans)
+
+
+def reconcile_files(force=False):
+    """Remove rows for cached files that were deleted outside of the cache helpers and files that have no row.
+
+    Each directory is listed once and compared against the filenames in the database. The modification time of
+    `RESPONSE_DIR` is stored as a generation marker, so nothing is listed when no file was added or removed since the
+    last reconciliation. Rows for files outside of `RESPONSE_DIR` (from older versions) are always checked. Files in
+    `RESPONSE_DIR` without a row (such as `*.tmp` files or the files of a lost `WriteBatch`) are removed once they are
+    older than `ORPHAN_MIN_AGE`
+
+    Args:
+        force: if True, reconcile even when the generation marker is unchanged. Default is False
+
+    Returns:
+        int: number of removed rows
+
+    """
+    with FILE_DATA.lock:
+        meta = FILE_DATA.db.load_table('meta')
+        marker = meta.find_one(key='generation')
+        generation = str(RESPONSE_DIR.stat().st_mtime_ns)  # Read before listing so later changes are not missed
+        if not force and marker is not None and marker['value'] == generation:
+            LOGGER.debug(f'Skipping file reconciliation. No changes in {RESPONSE_DIR}')
+            return 0
+
+        table = FILE_DATA.db.load_table('files')
+        # Select only the needed columns as tuples and compare plain strings. Converting each row to a dictionary or
+        #   a Path is slower than listing the directory
+        query = 'SELECT id, url, filename FROM files WHERE filename IS NOT NULL'
+        rows = FILE_DATA.db.executable.execute(query).fetchall()
+        response_dir = str(RESPONSE_DIR)
+        directories = {os.path.dirname(filename) for _row_id, _url, filename in rows} | {response_dir}
+        listed = set()
+        for directory in directories:
+            try:
+                with os.scandir(directory) as entries:
+                    listed.update(entry.path for entry in entries)
+            except FileNotFoundError:
+                LOGGER.debug(f'Directory was removed: {directory}')
+        removed_rows = [(row_id, url) for row_id, url, filename in rows if filename not in listed]
+        LOGGER.debug(f'Removing {len(removed_rows)} row(s) for files that were removed from {directories}')
+        referenced = {filename for _row_id, _url, filename in rows}
+        referenced.update(row['filename'] for row in WRITE_BATCH.rows.values() if row['filename'])
+        orphans = [path for path in listed if os.path.dirname(path) == response_dir and path not in referenced]
+
+        with FILE_DATA.db:  # Delete in batches within a single transaction
+            ids = [row_id for row_id, _url in removed_rows]
+            for idx in range(0, len(ids), DELETE_BATCH_SIZE):
+                table.delete(id=ids[idx:idx + DELETE_BATCH_SIZE])
+            legacy = directories - {response_dir}
+            meta.upsert({'key': 'generation', 'value': '' if legacy else generation}, ['key'])
+        for _row_id, url in removed_rows:
+            MEMORY_CACHE.discard(url)
+        remove_orphans(orphans)
+        return len(removed_rows)
 
 
 def initialize_cache():
     """Ensure that the directory and database exist. Remove files from database if manually removed."""
-    table = FILE_DATA.db.create_table('files')
+    RESPONSE_DIR.mkdir(exist_ok=True)
+    with FILE_DATA.lock:
+        table = FILE_DATA.db.create_table('files')
+        for column, column_type in [('filename', FILE_DATA.db.types.text), ('url', FILE_DATA.db.types.text),
+                                    ('timestamp', FILE_DATA.db.types.float), ('etag', FILE_DATA.db.types.text),
+                                    ('last_modified', FILE_DATA.db.types.text), ('body', LargeBinary)]:
+            if not table.has_column(column):
+                table.create_column(column, column_type)
+        if not table.has_index(['url']):
+            remove_duplicate_urls(table)
+            table.create_index(['url'], name='ix_files_url', unique=True)
+        if not table.has_index(['filename']):
+            table.create_index(['filename'], name='ix_files_filename')
+
+        meta = FILE_DATA.db.create_table('meta', primary_id='key', primary_type=FILE_DATA.db.types.string(64))
+        if not meta.has_column('value'):
+            meta.create_column('value', FILE_DATA.db.types.text)
+        if not meta.has_index(['key']):
+            # Created here because `upsert()` would otherwise create the index within the transaction in
+            #   `reconcile_files()`
+            meta.create_index(['key'], name='ix_meta_key')
+        reconcile_files()
+
+        dictionaries = FILE_DATA.db.create_table('dictionaries')
+        if not dictionaries.has_column('data'):
+            dictionaries.create_column('data', LargeBinary)
+        rows = [*dictionaries.all(order_by='id')]
+        for idx, row in enumerate(rows):
+            CACHE_COMPRESSOR.load_dictionary(row['data'], use=idx == len(rows) - 1)
+
+
+def migrate_files_to_blobs(remove_files_after=True):
+    """Move responses cached as JSON files into the lookup database so that the whole cache is a single file.
 
-    removed_files = []
-    for row in table:
-        if not Path(row['filename']).is_file():
-            removed_files.append(row['filename'])
-    LOGGER.debug(f'Removing files: {removed_files}' if len(removed_files) > 0 else 'No removed files found')
+    Args:
+        remove_files_after: if True, delete each JSON file after the migration is committed. Default is True
 
-    for filename in removed_files:
-        table.delete(filename=filename)
+    Returns:
+        int: number of migrated responses
+
+    """
+    initialize_cache()
+    with FILE_DATA.lock:
+        table = FILE_DATA.db.load_table('files')
+        rows = [*table.find(body=None)]
+        with FILE_DATA.db:  # Commit all rows in a single transaction
+            for row in rows:
+                # Minify the pretty-printed files before compressing
+                body = CACHE_COMPRESSOR.compress(JSON_CODEC.dumps(JSON_CODEC.loads(read_payload(row))))
+                table.update({'id': row['id'], 'filename': None, 'body': body}, ['id'])
+        LOGGER.info(f'Migrated {len(rows)} cached responses from {CACHE_DIR} into {FILE_DATA.database_path}')
+    if remove_files_after:
+        remove_files(row['filename'] for row in rows)
+    return len(rows)
 
 
 def match_url_in_cache(url):
@@ -112,28 +734,148 @@ def match_url_in_cache(url):
         list: list of match object with keys of the SQL table
 
     """
-    return [*FILE_DATA.db.load_table('files').find(url=url)]
+    with FILE_DATA.lock:
+        if url in WRITE_BATCH.rows:
+            return [WRITE_BATCH.rows[url]]
+        return [*FILE_DATA.db.load_table('files').find(url=url)]
+
+
+def match_urls_before(pattern, timestamp):
+    """Return the rows of the file database for URLs that match a pattern and were stored before the timestamp.
+
+    Args:
+        pattern: SQL `LIKE` pattern for the URL (ex: `%/anime?include=categories`)
+        timestamp: only return rows that were stored or last revalidated before this time
+
+    Returns:
+        list: list of match object with keys of the SQL table
+
+    """
+    with FILE_DATA.lock:
+        return [*FILE_DATA.db.load_table('files').find(url={'like': pattern}, timestamp={'<': timestamp})]
+
+
+def train_cache_dictionary(max_samples=1000, dict_size=64 * 1024, recompress=True):
+    """Train a zstd dictionary on the most recent cached responses and use it for new responses.
+
+    The dictionary is stored in the lookup database, so it is loaded again by `initialize_cache()`
+
+    Args:
+        max_samples: maximum number of cached responses to train on. Default is 1000
+        dict_size: maximum size of the dictionary in bytes. Default is 64 KiB
+        recompress: if True, re-encode the responses stored as blobs with the new dictionary. Default is True
+
+    Returns:
+        int: ID of the new dictionary
+
+    Raises:
+        RuntimeError: if there are no cached responses to train on
+
+    """
+    initialize_cache()
+    with FILE_DATA.lock:
+        table = FILE_DATA.db.load_table('files')
+        rows = [*table.find(order_by='-timestamp', _limit=max_samples)]
+    if not rows:
+        raise RuntimeError(f'No cached responses to train a dictionary on in {FILE_DATA.database_path}')
+    dict_data = CACHE_COMPRESSOR.train_dictionary([read_payload(row) for row in rows], dict_size=dict_size)
+    with FILE_DATA.lock:
+        with FILE_DATA.db:
+            FILE_DATA.db.load_table('dictionaries').insert({'data': dict_data})
+            if recompress:
+                for row in table.find(body={'not': None}):
+                    body = CACHE_COMPRESSOR.compress(read_payload(row))
+                    table.update({'id': row['id'], 'body': body}, ['id'])
+    LOGGER.info(f'Trained zstd dictionary {CACHE_COMPRESSOR.dict_id} on {len(rows)} cached responses')
+    return CACHE_COMPRESSOR.dict_id
+
+
+def read_payload(row):
+    """Read the uncompressed JSON bytes for a row of the file database in any of the supported formats.
+
+    Args:
+        row: match object from `match_url_in_cache()`
+
+    Returns:
+        bytes: JSON response body
+
+    """
+    if row.get('body') is not None:
+        return CACHE_COMPRESSOR.decompress(row['body'])
+    return CACHE_COMPRESSOR.decompress(Path(row['filename']).read_bytes())
+
+
+def load_response(row):
+    """Load the cached response for a row of the file database and add it to the `MEMORY_CACHE`.
+
+    Args:
+        row: match object from `match_url_in_cache()`
+
+    Returns:
+        dict: cached Kitsu API response
+
+    """
+    LOGGER.debug(f"Loading response for {row['url']} from {row.get('filename') or 'blob'}")
+    data = read_payload(row)
+    obj = JSON_CODEC.loads(data)
+    MEMORY_CACHE.put(row['url'], obj, len(data), row['timestamp'])
+    return obj
+
+
+def touch_response(url):
+    """Mark the cached response as fresh after the API confirmed that it has not been modified.
+
+    Args:
+        url: full URL of the cached response
+
+    Returns:
+        float: the new timestamp
+
+    """
+    timestamp = time.time()
+    with FILE_DATA.lock:
+        if url in WRITE_BATCH.rows:
+            WRITE_BATCH.rows[url]['timestamp'] = timestamp
+        FILE_DATA.db.load_table('files').update({'url': url, 'timestamp': timestamp}, ['url'])
+    return timestamp
+
 
+def store_response(prefix, url, obj, replace=False, validators=None):
+    """Store the response object in the cache (see `CachePolicy.storage`) and track in a SQLite database.
 
-def store_response(prefix, url, obj):
-    """Store the response object as a JSON file and track in a SQLite database.
+    Safe to call from concurrent threads. The file is written completely before the row is added, so a crash never
+    leaves a row for a missing or partially written file. Rows may be buffered and committed in batches (see
+    `WriteBatch`)
 
     Args:
         prefix: string used to create more recognizable filenames
         url: full URL to use as a reference if already downloaded
         obj: JSON object to write
+        replace: if True, replace any existing entry for the URL instead of raising an error. Default is False
+        validators: optional dictionary with the `etag` and `last_modified` response headers for revalidation
 
     Raises:
         RuntimeError: if duplicate match found when storing
 
     """
-    filename = CACHE_DIR / f'{prefix}_{uniq_table_id()}.json'
-    new_row = {'filename': str(filename), 'url': url, 'timestamp': time.time()}
-    # Check that the URL isn't already in the database
-    LOGGER.debug(f'inserting row: {new_row}')
-    matches = match_url_in_cache(url)
-    if len(matches) > 0:
-        raise RuntimeError(f'Already have an entry for this URL (`{url}`): {matches}')
-    # Update the database and store the file
-    FILE_DATA.db.load_table('files').insert(new_row)
-    pretty_dump_json(filename, obj)
+    new_row = {'filename': None, 'url': url, 'timestamp': time.time(), 'etag': None, 'last_modified': None,
+               'body': None}
+    new_row.update(validators or {})
+    data = JSON_CODEC.dumps(obj)
+    payload = CACHE_COMPRESSOR.compress(data)
+    if CACHE_POLICY.storage == 'blob':
+        new_row['body'] = payload
+    else:
+        new_row['filename'] = str(RESPONSE_DIR / f'{prefix}_{uniq_table_id()}{CACHE_COMPRESSOR.suffix}')
+        LOGGER.debug(f"Creating file: {new_row['filename']}")
+        write_file_atomic(new_row['filename'], payload)
+    with FILE_DATA.lock:
+        # The URL has a unique index, so the lookup and the upsert are both index seeks
+        existing = WRITE_BATCH.find(url)
+        if existing is not None and not replace:
+            if new_row['filename']:
+                remove_files([new_row['filename']])
+            raise RuntimeError(f"Already have an entry for this URL (`{url}`): {existing.get('id')}")
+        LOGGER.debug(f"Upserting row for {url} (filename={new_row['filename']})")
+        WRITE_BATCH.write(new_row, existing)
+        MEMORY_CACHE.put(url, obj, len(data), new_row['timestamp'])
@@ -0,0 +1,230 @@
+"""Record and replay transport for deterministic, offline requests to the Kitsu API.
+
+The `CassetteAdapter` is a `requests` transport adapter, so it is mounted on the shared session like any other
+transport. In `record` mode, every request is sent to the network and the response is saved to the cassette file. In
+`replay` mode, responses are only read from the cassette and a missing URL raises an error instead of touching the
+network. The `auto` mode replays known URLs and records the rest
+
+```py
+from kitsu_lib.cassette_helpers import CassetteAdapter
+from kitsu_lib.session_helpers import HTTP_SESSION
+
+HTTP_SESSION.configure(transport=CassetteAdapter('kitsu_cassette.json', mode='record'))
+scrape_kitsu_unsafe('KyleKing')
+HTTP_SESSION.close()  # Saves the cassette
+
+# Later, with no network access
+HTTP_SESSION.configure(transport=CassetteAdapter('kitsu_cassette.json', mode='replay'))
+```
+
+"""
+
+import base64
+import threading
+from pathlib import Path
+from urllib.parse import parse_qsl, urlencode, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import BaseAdapter, HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+
+from .codec_helpers import JSON_CODEC
+from .kitsu_helpers import LOGGER
+
+CASSETTE_MODES = ['record', 'replay', 'auto']
+"""Supported modes for the `CassetteAdapter`."""
+
+SKIPPED_HEADERS = ['Content-Encoding', 'Content-Length', 'Transfer-Encoding', 'Connection', 'Set-Cookie']
+"""Response headers that are not recorded because the body is stored decoded."""
+
+CONDITIONAL_HEADERS = ['If-None-Match', 'If-Modified-Since']
+"""Request headers removed while recording, so that a bodiless `304` never replaces a recorded response."""
+
+
+def cassette_key(method, url):
+    """Return the key used to match a request against the recorded interactions.
+
+    Query parameters are sorted and percent-encoding is normalized, so equivalent URLs match
+
+    Args:
+        method: HTTP method (ex: `GET`)
+        url: full URL including any query parameters
+
+    Returns:
+        str: normalized key
+
+    """
+    prepared = requests.PreparedRequest()
+    prepared.prepare_url(url, None)
+    parts = urlsplit(prepared.url)
+    query = urlencode(sorted(parse_qsl(parts.query, keep_blank_values=True)))
+    return f'{method.upper()} {urlunsplit(parts._replace(query=query, fragment=""))}'
+
+
+class CassetteAdapter(BaseAdapter):
+    """Transport adapter that records responses to a cassette file and replays them without network access."""
+
+    path = None
+    """Path to the cassette JSON file."""
+
+    mode = 'replay'
+    """One of `CASSETTE_MODES`."""
+
+    def __init__(self, path=None, mode='replay', transport=None):
+        """Load any existing interactions from the cassette file.
+
+        Args:
+            path: optional Path or plain string filename of the cassette. If None, interactions are only kept in memory
+            mode: one of `record`, `replay`, or `auto`. Default is `replay`
+            transport: optional transport adapter used to record. Default is a new `HTTPAdapter`
+
+        Raises:
+            RuntimeError: if the mode is not supported
+
+        """
+        super().__init__()
+        if mode not in CASSETTE_MODES:
+            raise RuntimeError(f'Unknown cassette mode `{mode}`. Expected one of: {CASSETTE_MODES}')
+        self.path = None if path is None else Path(path)
+        self.mode = mode
+        self.transport = transport
+        self._lock = threading.Lock()
+        self._interactions = {}
+        self._modified = False
+        if self.path is not None and self.path.is_file():
+            for interaction in JSON_CODEC.load_file(self.path)['interactions']:
+                self._interactions[cassette_key(interaction['method'], interaction['url'])] = interaction
+            LOGGER.debug(f'Loaded {len(self._interactions)} interactions from {self.path}')
+
+    def __len__(self):
+        """Return the number of recorded interactions.
+
+        Returns:
+            int: number of interactions
+
+        """
+        return len(self._interactions)
+
+    def add(self, url, body, status=200, headers=None, method='GET'):
+        """Add or replace a recorded interaction. Useful for seeding a cassette with known responses.
+
+        Args:
+            url: full URL of the request
+            body: response body as a JSON-serializable object, str, or bytes
+            status: HTTP status code. Default is 200
+            headers: optional dictionary of response headers
+            method: HTTP method. Default is `GET`
+
+        """
+        if not isinstance(body, (str, bytes)):
+            body = JSON_CODEC.dumps(body)
+            headers = {'Content-Type': 'application/vnd.api+json', **(headers or {})}
+        if isinstance(body, str):
+            body = body.encode('utf-8')
+        interaction = {'method': method.upper(), 'url': url, 'status': status, 'headers': headers or {}}
+        try:
+            interaction['body'] = body.decode('utf-8')
+        except UnicodeDecodeError:
+            interaction['body_base64'] = base64.b64encode(body).decode('ascii')
+        with self._lock:
+            self._interactions[cassette_key(method, url)] = interaction
+            self._modified = True
+
+    def seed_files(self, url_map):
+        """Seed the cassette with responses stored as JSON files (such as the files in `tests/Data`).
+
+        Args:
+            url_map: dictionary of URL to the Path of a JSON file with the response body
+
+        """
+        for url, filename in url_map.items():
+            self.add(url, Path(filename).read_bytes(), headers={'Content-Type': 'application/vnd.api+json'})
+
+    def build_response(self, request, interaction):
+        """Create a `requests.Response` from a recorded interaction.
+
+        Args:
+            request: `requests.PreparedRequest` that is being answered
+            interaction: recorded interaction dictionary
+
+        Returns:
+            requests.Response: response with the recorded status, headers, and body
+
+        """
+        response = requests.Response()
+        response.status_code = interaction['status']
+        response.headers = CaseInsensitiveDict(interaction['headers'])
+        if 'body_base64' in interaction:
+            response._content = base64.b64decode(interaction['body_base64'])
+        else:
+            response._content = interaction['body'].encode('utf-8')
+        # The body is already in memory, so `iter_content()` must not try to read from `raw`
+        response._content_consumed = True
+        response.encoding = 'utf-8'
+        response.url = request.url
+        response.request = request
+        response.connection = self
+        return response
+
+    def record(self, request, **kwargs):
+        """Send the request to the network and record the response.
+
+        Conditional request headers are removed, so the full response is always recorded (and returned)
+
+        Args:
+            request: `requests.PreparedRequest` to send
+            kwargs: keyword arguments passed by `requests.Session.send()`
+
+        Returns:
+            requests.Response: response rebuilt from the recorded interaction
+
+        """
+        if self.transport is None:
+            self.transport = HTTPAdapter()
+        request = request.copy()
+        for header in CONDITIONAL_HEADERS:
+            request.headers.pop(header, None)
+        live = self.transport.send(request, **kwargs)
+        headers = {key: value for key, value in live.headers.items() if key not in SKIPPED_HEADERS}
+        self.add(request.url, live.content, status=live.status_code, headers=headers, method=request.method)
+        live.close()
+        LOGGER.debug(f'Recorded {request.method} {request.url} ({live.status_code})')
+        return self.build_response(request, self._interactions[cassette_key(request.method, request.url)])
+
+    def send(self, request, **kwargs):
+        """Replay or record the response for a request.
+
+        Args:
+            request: `requests.PreparedRequest` to send
+            kwargs: keyword arguments passed by `requests.Session.send()`
+
+        Returns:
+            requests.Response: recorded response
+
+        Raises:
+            RuntimeError: if the request was not recorded and the mode is `replay`
+
+        """
+        if self.mode == 'record':
+            return self.record(request, **kwargs)
+        interaction = self._interactions.get(cassette_key(request.method, request.url))
+        if interaction is not None:
+            return self.build_response(request, interaction)
+        if self.mode == 'auto':
+            return self.record(request, **kwargs)
+        raise RuntimeError(f'No recorded response for {request.method} {request.url} in cassette: {self.path}')
+
+    def save(self):
+        """Write the recorded interactions to the cassette file if any were added."""
+        with self._lock:
+            if self.path is None or not self._modified:
+                return
+            LOGGER.debug(f'Saving {len(self._interactions)} interactions to {self.path}')
+            JSON_CODEC.dump_file(self.path, {'interactions': [*self._interactions.values()]}, indent=True)
+            self._modified = False
+
+    def close(self):
+        """Save the cassette and close the recording transport."""
+        self.save()
+        if self.transport is not None:
+            self.transport.close()
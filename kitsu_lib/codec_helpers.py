@@ -0,0 +1,119 @@
+"""JSON codec used for Kitsu API responses and the local cache.
+
+Decoding cached responses is the dominant CPU cost when re-running a scrape, so the `JSON_CODEC` uses `orjson` when
+the optional package is installed and falls back to the standard library `json` module otherwise
+
+```py
+from kitsu_lib.codec_helpers import JSON_CODEC
+
+JSON_CODEC.configure(backend='json')  # Force the standard library (for example, to compare output)
+```
+
+"""
+
+import json
+from pathlib import Path
+
+from .kitsu_helpers import LOGGER
+
+try:
+    import orjson
+except ImportError:  # pragma: no cover
+    orjson = None
+
+
+class JSONCodec:
+    """Encode and decode JSON with the fastest available backend."""
+
+    backend = None
+    """Name of the active backend (`'orjson'` or `'json'`)."""
+
+    def __init__(self, backend=None):
+        """Select the backend.
+
+        Args:
+            backend: optional backend name (`'orjson'` or `'json'`). Default is `'orjson'` if installed
+
+        """
+        self.configure(backend=backend)
+
+    def configure(self, backend=None):
+        """Select the backend.
+
+        Args:
+            backend: optional backend name (`'orjson'` or `'json'`). Default is `'orjson'` if installed
+
+        Raises:
+            RuntimeError: if the backend is unknown or not installed
+
+        """
+        if backend is None:
+            backend = 'json' if orjson is None else 'orjson'
+        if backend not in ['orjson', 'json']:
+            raise RuntimeError(f'Unknown JSON backend: {backend}')
+        if backend == 'orjson' and orjson is None:
+            raise RuntimeError('The orjson backend was requested, but `orjson` is not installed')
+        LOGGER.debug(f'Using JSON backend: {backend}')
+        self.backend = backend
+
+    def loads(self, data):
+        """Decode a JSON document.
+
+        Args:
+            data: JSON document as bytes or str
+
+        Returns:
+            object: decoded JSON
+
+        Raises:
+            JSONDecodeError: if the document is not valid JSON (`orjson.JSONDecodeError` is a subclass)
+
+        """  # noqa: DAR402
+        if self.backend == 'orjson':
+            return orjson.loads(data)
+        return json.loads(data)
+
+    def dumps(self, obj, indent=False):
+        """Encode an object as UTF-8 JSON.
+
+        Args:
+            obj: JSON-serializable object
+            indent: if True, indent the output for readability. Default is False
+
+        Returns:
+            bytes: encoded JSON document
+
+        """
+        if self.backend == 'orjson':
+            return orjson.dumps(obj, option=orjson.OPT_INDENT_2 if indent else 0)
+        # Match the orjson output, which only supports an indent of 2 and does not escape non-ASCII characters
+        if indent:
+            return json.dumps(obj, indent=2, separators=(',', ': '), ensure_ascii=False).encode('utf-8')
+        return json.dumps(obj, separators=(',', ':'), ensure_ascii=False).encode('utf-8')
+
+    def load_file(self, filename):
+        """Read and decode a JSON file.
+
+        Args:
+            filename: Path or plain string filename to read
+
+        Returns:
+            object: decoded JSON
+
+        """
+        return self.loads(Path(filename).read_bytes())
+
+    def dump_file(self, filename, obj, indent=False):
+        """Encode an object and write it to a JSON file.
+
+        Args:
+            filename: Path or plain string filename to write
+            obj: JSON-serializable object
+            indent: if True, indent the output for readability. Default is False
+
+        """
+        Path(filename).write_bytes(self.dumps(obj, indent=indent))
+
+
+JSON_CODEC = JSONCodec()
+"""Global instance of the JSONCodec() used for all API responses and cache files."""
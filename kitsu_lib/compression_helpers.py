@@ -0,0 +1,209 @@
+"""Compression for cached API responses.
+
+Cached responses are stored as minified JSON compressed with zstd when the optional `zstandard` package is installed
+(zlib otherwise). Kitsu documents share most of their structure, so a dictionary trained on the cache (see
+`train_cache_dictionary()`) further reduces the size of each response. The format is detected from the leading bytes,
+so plain JSON, zlib, and zstd payloads (with or without a dictionary) can all be read regardless of the current setting
+
+```py
+from kitsu_lib.compression_helpers import CACHE_COMPRESSOR
+
+CACHE_COMPRESSOR.configure(method='zlib', level=6)
+```
+
+"""
+
+import threading
+import zlib
+
+from .kitsu_helpers import LOGGER
+
+try:
+    import zstandard
+except ImportError:  # pragma: no cover
+    zstandard = None
+
+COMPRESSION_METHODS = ['zstd', 'zlib', 'none']
+"""Supported compression methods for new payloads."""
+
+ZSTD_MAGIC = b'\x28\xb5\x2f\xfd'
+"""Leading bytes of a zstd frame."""
+
+FILE_SUFFIXES = {'zstd': '.json.zst', 'zlib': '.json.zz', 'none': '.json'}
+"""File extension for responses cached as files with each compression method."""
+
+
+def is_zlib(data):
+    """Check if the payload starts with a valid zlib header. JSON always starts with `{`, `[`, or whitespace.
+
+    Args:
+        data: payload bytes
+
+    Returns:
+        bool: True if the payload is zlib compressed
+
+    """
+    return len(data) > 1 and data[0] & 0x0F == 8 and (data[0] * 256 + data[1]) % 31 == 0
+
+
+class CacheCompressor:
+    """Compress and decompress cached JSON payloads."""
+
+    method = None
+    """Compression method for new payloads (one of `COMPRESSION_METHODS`)."""
+
+    level = 3
+    """Compression level passed to zstd or zlib."""
+
+    dict_id = None
+    """ID of the zstd dictionary used for new payloads or None to compress without a dictionary."""
+
+    def __init__(self, method=None, level=3):
+        """Select the compression method.
+
+        Args:
+            method: optional compression method. Default is `zstd` if `zstandard` is installed, otherwise `zlib`
+            level: compression level. Default is 3
+
+        """
+        self._dictionaries = {}
+        self._local = threading.local()
+        self.configure(method=method, level=level)
+
+    def configure(self, method=None, level=None):
+        """Update the compression settings. Arguments left as None are unchanged.
+
+        Args:
+            method: compression method for new payloads (one of `COMPRESSION_METHODS`)
+            level: compression level
+
+        Raises:
+            RuntimeError: if the method is unknown or `zstandard` is not installed
+
+        """
+        if method is None and self.method is None:
+            method = 'zlib' if zstandard is None else 'zstd'
+        if method is not None:
+            if method not in COMPRESSION_METHODS:
+                raise RuntimeError(f'Unknown compression `{method}`. Expected one of: {COMPRESSION_METHODS}')
+            if method == 'zstd' and zstandard is None:
+                raise RuntimeError('zstd compression was requested, but `zstandard` is not installed')
+            self.method = method
+        self.level = self.level if level is None else level
+        self._local = threading.local()  # Discard compressors created with the previous settings
+
+    @property
+    def suffix(self):
+        """Return the file extension for responses cached as files.
+
+        Returns:
+            str: file extension for the current method
+
+        """
+        return FILE_SUFFIXES[self.method]
+
+    def load_dictionary(self, dict_data, use=True):
+        """Register a trained zstd dictionary so that payloads compressed with it can be read.
+
+        Args:
+            dict_data: bytes of the trained dictionary
+            use: if True, also compress new payloads with this dictionary. Default is True
+
+        Returns:
+            int: dictionary ID or None if `zstandard` is not installed
+
+        """
+        if zstandard is None:
+            LOGGER.warning('Skipping zstd dictionary because `zstandard` is not installed')
+            return None
+        dictionary = zstandard.ZstdCompressionDict(dict_data)
+        dict_id = dictionary.dict_id()
+        self._dictionaries[dict_id] = dictionary
+        if use:
+            self.dict_id = dict_id
+            self._local = threading.local()
+        return dict_id
+
+    def train_dictionary(self, samples, dict_size=64 * 1024):
+        """Train a zstd dictionary from sample payloads and use it for new payloads.
+
+        Args:
+            samples: list of uncompressed JSON payloads (bytes)
+            dict_size: maximum size of the dictionary in bytes. Default is 64 KiB
+
+        Returns:
+            bytes: dictionary data to persist and pass to `load_dictionary()` in later sessions
+
+        Raises:
+            RuntimeError: if `zstandard` is not installed
+
+        """
+        if zstandard is None:
+            raise RuntimeError('Training a dictionary requires the optional `zstandard` package')
+        dict_data = zstandard.train_dictionary(dict_size, samples, level=self.level).as_bytes()
+        dict_id = self.load_dictionary(dict_data)
+        LOGGER.debug(f'Trained zstd dictionary {dict_id} ({len(dict_data)} bytes) from {len(samples)} samples')
+        return dict_data
+
+    def _compressor(self):
+        """Return this thread's zstd compressor, which cannot be shared between threads.
+
+        Returns:
+            zstandard.ZstdCompressor: compressor for the current settings
+
+        """
+        compressor = getattr(self._local, 'compressor', None)
+        if compressor is None:
+            dictionary = self._dictionaries.get(self.dict_id)
+            compressor = zstandard.ZstdCompressor(level=self.level, dict_data=dictionary)
+            self._local.compressor = compressor
+        return compressor
+
+    def compress(self, data):
+        """Compress a JSON payload with the current method.
+
+        Args:
+            data: uncompressed JSON bytes
+
+        Returns:
+            bytes: compressed payload
+
+        """
+        if self.method == 'zstd':
+            return self._compressor().compress(data)
+        if self.method == 'zlib':
+            return zlib.compress(data, self.level)
+        return data
+
+    def decompress(self, data):
+        """Return the JSON bytes of a payload in any supported format.
+
+        Args:
+            data: payload bytes from the cache
+
+        Returns:
+            bytes: uncompressed JSON
+
+        Raises:
+            RuntimeError: if the payload needs `zstandard` or a dictionary that is not available
+
+        """
+        if data[:4] == ZSTD_MAGIC:
+            if zstandard is None:
+                raise RuntimeError('Cached response is zstd compressed, but `zstandard` is not installed')
+            dict_id = zstandard.get_frame_parameters(data).dict_id
+            if dict_id and dict_id not in self._dictionaries:
+                raise RuntimeError(f'Cached response requires zstd dictionary {dict_id}, which was not loaded')
+            decompressors = getattr(self._local, 'decompressors', None)
+            if decompressors is None:
+                decompressors = self._local.decompressors = {}
+            if dict_id not in decompressors:
+                decompressors[dict_id] = zstandard.ZstdDecompressor(dict_data=self._dictionaries.get(dict_id))
+            return decompressors[dict_id].decompress(data)
+        if is_zlib(data):
+            return zlib.decompress(data)
+        return data
+
+
+CACHE_COMPRESSOR = CacheCompressor()
+"""Global instance of the CacheCompressor() used for all cached responses."""
@@ -0,0 +1,188 @@
+"""Helpers for coalescing concurrent requests for the same resource and refreshing stale responses.
+
+When several workers miss the cache for the same URL at the same time, only the first ("leader") makes the request.
+The other callers wait for and share the leader's result (or exception). Threads and asyncio tasks share the same
+`IN_FLIGHT` registry, so a URL in flight on a worker thread is also awaited by the event loop and vice versa
+
+```py
+from kitsu_lib.flight_helpers import IN_FLIGHT
+
+resp = IN_FLIGHT.run(url, lambda: expensive_request(url))
+```
+
+"""
+
+import asyncio
+import threading
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from .kitsu_helpers import LOGGER
+
+
+class SingleFlight:
+    """Registry of in-flight calls keyed by a cache key so that only one call per key runs at a time."""
+
+    def __init__(self):
+        """Initialize an empty registry."""
+        self._lock = threading.Lock()
+        self._futures = {}
+
+    def claim(self, key):
+        """Return the future for the key and whether the caller is responsible for resolving it.
+
+        Args:
+            key: hashable cache key (typically the URL)
+
+        Returns:
+            tuple: `(future, is_leader)`. Only the leader may call `resolve()`
+
+        """
+        with self._lock:
+            future = self._futures.get(key)
+            if future is not None:
+                LOGGER.debug(f'Waiting on in-flight request for: {key}')
+                return future, False
+            future = Future()
+            self._futures[key] = future
+            return future, True
+
+    def resolve(self, key, future, result=None, error=None):
+        """Remove the key from the registry and share the leader's result with every waiting caller.
+
+        Args:
+            key: cache key passed to `claim()`
+            future: future returned by `claim()`
+            result: value to share when the call succeeded
+            error: optional exception to share when the call failed
+
+        """
+        with self._lock:
+            self._futures.pop(key, None)
+        if error is not None:
+            future.set_exception(error)
+        else:
+            future.set_result(result)
+
+    def run(self, key, func):
+        """Call `func()` unless a call for the same key is already in flight, then return the shared result.
+
+        Args:
+            key: hashable cache key
+            func: callable with no arguments
+
+        Returns:
+            object: the return value of `func()` from the leader
+
+        Raises:
+            Exception: any exception raised by the leader's `func()`
+
+        """  # noqa: DAR401
+        future, is_leader = self.claim(key)
+        if not is_leader:
+            return future.result()
+        try:
+            result = func()
+        except BaseException as error:
+            self.resolve(key, future, error=error)
+            raise
+        self.resolve(key, future, result=result)
+        return result
+
+    async def run_async(self, key, coro_func):
+        """Asyncio variant of `run()`.
+
+        Args:
+            key: hashable cache key
+            coro_func: coroutine function with no arguments
+
+        Returns:
+            object: the return value of `coro_func()` from the leader
+
+        Raises:
+            Exception: any exception raised by the leader's `coro_func()`
+
+        """  # noqa: DAR401
+        future, is_leader = self.claim(key)
+        if not is_leader:
+            return await asyncio.wrap_future(future)
+        try:
+            result = await coro_func()
+        except BaseException as error:
+            self.resolve(key, future, error=error)
+            raise
+        self.resolve(key, future, result=result)
+        return result
+
+
+IN_FLIGHT = SingleFlight()
+"""Global instance of the SingleFlight() registry shared by `selective_request()` and its asyncio variant."""
+
+
+class BackgroundRefresh:
+    """Run at most one background refresh per key on a small pool of worker threads."""
+
+    max_workers = 2
+    """Number of worker threads for background refreshes."""
+
+    def __init__(self, max_workers=2):
+        """Store the pool size. The pool is created on first use.
+
+        Args:
+            max_workers: number of worker threads. Default is 2
+
+        """
+        self.max_workers = max_workers
+        self._lock = threading.Lock()
+        self._pending = {}
+        self._executor = None
+
+    def submit(self, key, func):
+        """Schedule `func()` unless a refresh for the same key is already pending.
+
+        Args:
+            key: hashable cache key (typically the URL)
+            func: callable with no arguments
+
+        Returns:
+            bool: True if a new refresh was scheduled
+
+        """
+        with self._lock:
+            if key in self._pending:
+                return False
+            if self._executor is None:
+                self._executor = ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='kitsu-refresh')
+            LOGGER.debug(f'Scheduling background refresh for: {key}')
+            self._pending[key] = self._executor.submit(self._run, key, func)
+            return True
+
+    def _run(self, key, func):
+        """Run a refresh and log any error, since no caller is waiting on the result.
+
+        Args:
+            key: cache key passed to `submit()`
+            func: callable with no arguments
+
+        """
+        try:
+            func()
+        except Exception as error:  # noqa: B902
+            LOGGER.warning(f'Background refresh failed for {key}: {error}')
+        finally:
+            with self._lock:
+                self._pending.pop(key, None)
+
+    def wait(self, timeout=None):
+        """Block until all pending refreshes have finished.
+
+        Args:
+            timeout: optional maximum number of seconds to wait
+
+        """
+        with self._lock:
+            futures = [*self._pending.values()]
+        wait(futures, timeout=timeout)
+
+
+BACKGROUND_REFRESH = BackgroundRefresh()
+"""Global instance of the BackgroundRefresh() used to update stale cached responses."""
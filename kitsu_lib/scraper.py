@@ -1,47 +1,254 @@
 """Main scraper interface."""
 
+import asyncio
+import functools
+import queue
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+from furl import furl
+
 from .analysis import create_kitsu_database, merge_anime_info
-from .api_helpers import get_anime, get_library, get_streams, get_user_id, selective_request
-from .cache_helpers import CACHE_DIR, KITSU_DATA, initialize_cache, pretty_dump_json
+from .api_helpers import (get_anime, get_library, get_streams, get_user_id, index_included, refresh_stale_anime,
+                          selective_request, split_library_entry)
+from .async_helpers import get_anime_async, get_streams_async, selective_request_async
+from .cache_helpers import CACHE_DIR, KITSU_DATA, WRITE_BATCH, initialize_cache, pretty_dump_json
 from .kitsu_helpers import LOGGER, configure_logger, export_table_as_csv
+from .session_helpers import HTTP_SESSION
 
+DEFAULT_CONCURRENCY = 8
+"""Default maximum number of concurrent requests for the asyncio scraping engine."""
+
+DEFAULT_PREFETCH = 1
+"""Default number of library pages to fetch ahead of the page being processed."""
 
-def scrape_kitsu_unsafe(username=None, limit=None):
-    """Scrape the anime from the user's database into local storage.
+
+def next_library_url(library_page, index):
+    """Return the URL of the next library page, if any.
 
     Args:
-        username: optional Kitsu user name. Otherwise falls back to input()
-        limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+        library_page: Kitsu API response from `get_library()` or a previous 'next' page
+        index: number of library pages processed so far. Only used for logging
+
+    Returns:
+        str: next URL or None if there are no more pages
 
     """
-    initialize_cache()
-    user_id = get_user_id(username)
-    LOGGER.debug(f'Scraping Kitsu for {username} ({user_id})')
+    next_url = None
+    try:
+        next_url = library_page['links']['next']
+    except (AttributeError, KeyError) as error:
+        LOGGER.info(f'Failed to find next URL (index:{index}) with error: {error}')
+    return next_url
 
-    # Loop through a user's library
+
+def follow_library_pages(library_page, limit=None):
+    """Yield each library page, following the 'next' links.
+
+    Args:
+        library_page: first Kitsu API response from `get_library()`
+        limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+
+    Yields:
+        dict: Kitsu API response for each library page
+
+    """
     index = 0
-    all_data = []
-    library_page = get_library(user_id, is_anime=True)
-    while library_page and (limit is None or index <= limit):
-        this_lib_page = library_page
-        for anime_entry in this_lib_page['data']:
-            anime = get_anime(anime_entry['relationships']['anime']['links']['related'])
-            streams = get_streams(anime['data']['relationships']['streamingLinks']['links']['related'])
-            # FIXME: Store these datasets in three tables. See README for notes on flattening the JSON
-            all_data.append(merge_anime_info(anime_entry, anime, streams))
+    while library_page:
+        yield library_page
 
         # Check if there is a 'next' URL available or if the iterations have reached their limit
         index += 1
-        next_url = None
-        try:
-            next_url = this_lib_page['links']['next']
-        except (AttributeError, KeyError) as error:
-            LOGGER.info(f'Failed to find next URL (index:{index}) with error: {error}')
+        if limit is not None and index > limit:
+            break
+        next_url = next_library_url(library_page, index)
         library_page = False
         if next_url:
             LOGGER.debug(f'Fetching next library page URL: {next_url}')
             library_page = selective_request('library-next', next_url)
 
+
+def library_page_urls(library_page):
+    """Compute the URLs of all remaining library pages from the total entry count of the first page.
+
+    Args:
+        library_page: first Kitsu API response from `get_library()`
+
+    Returns:
+        list: URLs for each remaining page in order. Empty if there is no next page or `meta.count` is unknown
+
+    """
+    next_url = (library_page.get('links') or {}).get('next')
+    count = (library_page.get('meta') or {}).get('count')
+    if not next_url or count is None:
+        return []
+
+    url = furl(next_url)
+    page_limit = int(url.args.get('page[limit]') or len(library_page['data']))
+    first_offset = int(url.args.get('page[offset]') or page_limit)
+    urls = [next_url]
+    for offset in range(first_offset + page_limit, count, page_limit):
+        url.args['page[offset]'] = str(offset)
+        urls.append(url.url)
+    return urls
+
+
+def fetch_library_pages_parallel(library_page, limit=None, parallel_pages=DEFAULT_CONCURRENCY):
+    """Yield each library page. The remaining pages are computed from `meta.count` and requested concurrently.
+
+    Args:
+        library_page: first Kitsu API response from `get_library()`
+        limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+        parallel_pages: maximum number of concurrent page requests. Default is `DEFAULT_CONCURRENCY`
+
+    Yields:
+        dict: Kitsu API response for each library page in order
+
+    """
+    yield library_page
+    urls = library_page_urls(library_page)
+    if limit is not None:
+        urls = urls[:limit]
+    LOGGER.debug(f'Fetching {len(urls)} remaining library pages with {parallel_pages} workers')
+    with ThreadPoolExecutor(max_workers=parallel_pages) as executor:
+        yield from executor.map(functools.partial(selective_request, 'library-next'), urls)
+
+
+def iter_library_pages(library_page, limit=None, prefetch=DEFAULT_PREFETCH, parallel_pages=None):
+    """Yield each library page. With `prefetch`, the next pages are requested while the current page is processed.
+
+    Pages are fetched on a background thread, which waits for a free slot before each request, so at most `prefetch`
+    pages are fetched ahead of the page being processed
+
+    Args:
+        library_page: first Kitsu API response from `get_library()`
+        limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+        prefetch: number of pages to fetch ahead. Set to 0 to fetch each page only when needed. Default is
+            `DEFAULT_PREFETCH`
+        parallel_pages: optional maximum number of concurrent page requests. When set and the first page reports
+            `meta.count`, all remaining pages are requested by offset instead of following each 'next' link
+
+    Yields:
+        dict: Kitsu API response for each library page in order
+
+    Raises:
+        Exception: any exception raised while fetching a page is re-raised in the caller's thread
+
+    """
+    if parallel_pages and library_page_urls(library_page):
+        yield from fetch_library_pages_parallel(library_page, limit, parallel_pages)
+        return
+    if not prefetch:
+        yield from follow_library_pages(library_page, limit)
+        return
+
+    pages = queue.Queue()
+    slots = threading.Semaphore(prefetch)
+    stop = threading.Event()
+
+    def acquire():
+        while not stop.is_set():
+            if slots.acquire(timeout=0.1):
+                return True
+        return False
+
+    def produce():
+        # A slot is taken before each fetch and only released once the caller receives that page
+        page_iter = follow_library_pages(library_page, limit)
+        try:
+            while acquire():
+                page = next(page_iter, None)
+                if page is None:
+                    break
+                pages.put(('page', page))
+        except Exception as error:  # noqa: B902
+            pages.put(('error', error))
+        pages.put(('done', None))
+
+    producer = threading.Thread(target=produce, name='library-prefetch', daemon=True)
+    producer.start()
+    try:
+        while True:
+            kind, value = pages.get()
+            if kind == 'done':
+                break
+            if kind == 'error':
+                raise value
+            slots.release()
+            yield value
+    finally:
+        stop.set()
+        producer.join()
+
+
+def resolve_included(anime_entry, included_index):
+    """Merge a library entry using only the compound document of the library page.
+
+    Args:
+        anime_entry: entry from within library response
+        included_index: optional dictionary from `index_included()` for the library page
+
+    Returns:
+        dict: single summary dictionary from `merge_anime_info()` or None if the entry could not be resolved locally
+
+    """
+    if included_index:
+        try:
+            anime, streams = split_library_entry(anime_entry, included_index)
+            return merge_anime_info(anime_entry, anime, streams)
+        except KeyError as error:
+            LOGGER.warning(f"Library entry {anime_entry['id']} not resolved from included resources: {error}")
+    return None
+
+
+def resolve_entry(anime_entry, included_index=None):
+    """Fetch the anime and streams for a library entry and merge into a single summary dictionary.
+
+    Args:
+        anime_entry: entry from within library response
+        included_index: optional dictionary from `index_included()`. When set, the related resources are read from the
+            library page and only fetched if missing
+
+    Returns:
+        dict: single summary dictionary from `merge_anime_info()`
+
+    """
+    data = resolve_included(anime_entry, included_index)
+    if data is not None:
+        return data
+    anime = get_anime(anime_entry['relationships']['anime']['links']['related'])
+    streams = get_streams(anime['data']['relationships']['streamingLinks']['links']['related'])
+    # FIXME: Store these datasets in three tables. See README for notes on flattening the JSON
+    return merge_anime_info(anime_entry, anime, streams)
+
+
+async def resolve_entry_async(anime_entry, semaphore=None, included_index=None):
+    """Asyncio variant of `resolve_entry()`.
+
+    Args:
+        anime_entry: entry from within library response
+        semaphore: optional `asyncio.Semaphore` to limit the number of concurrent requests
+        included_index: optional dictionary from `index_included()`
+
+    Returns:
+        dict: single summary dictionary from `merge_anime_info()`
+
+    """
+    data = resolve_included(anime_entry, included_index)
+    if data is not None:
+        return data
+    anime = await get_anime_async(anime_entry['relationships']['anime']['links']['related'], semaphore)
+    streams = await get_streams_async(anime['data']['relationships']['streamingLinks']['links']['related'], semaphore)
+    return merge_anime_info(anime_entry, anime, streams)
+
+
+def store_summary(all_data):
+    """Write the merged library data to the summary JSON file, Kitsu database, and CSV file.
+
+    Args:
+        all_data: list of summary dictionaries from `merge_anime_info()`
+
+    """
     summary_file_path = CACHE_DIR / 'all_data.json'
     pretty_dump_json(summary_file_path, {'data': all_data})
     create_kitsu_database(summary_file_path)
@@ -50,17 +257,130 @@ def scrape_kitsu_unsafe(username=None, limit=None):
     export_table_as_csv(csv_filename, KITSU_DATA.db.load_table('kitsu'))
 
 
-def scrape_kitsu(username=None, limit=None):
+def scrape_kitsu_unsafe(username=None, limit=None, workers=None, compound=False, prefetch=DEFAULT_PREFETCH,
+                        parallel_pages=None):
+    """Scrape the anime from the user's database into local storage.
+
+    Args:
+        username: optional Kitsu user name. Otherwise falls back to input()
+        limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+        workers: optional number of threads used to fetch the anime and streams for each library entry. Default is
+            None, which fetches each entry sequentially
+        compound: if True, request library pages as compound documents so that the anime, categories, and streams
+            are resolved from each page instead of two additional requests per entry. Default is False
+        prefetch: number of library pages to fetch ahead while the current page is processed. Default is
+            `DEFAULT_PREFETCH`
+        parallel_pages: optional maximum number of library pages to request concurrently by offset once the total
+            count is known from the first page. Default is None (follow the 'next' links)
+
+    """
+    initialize_cache()
+    if not compound:
+        # Refresh the cached anime in bulk instead of revalidating each entry
+        refresh_stale_anime()
+    user_id = get_user_id(username)
+    LOGGER.debug(f'Scraping Kitsu for {username} ({user_id}) with workers={workers}')
+
+    executor = None
+    if workers:
+        HTTP_SESSION.ensure_pool_size(workers)
+        executor = ThreadPoolExecutor(max_workers=workers)
+
+    # Loop through a user's library
+    all_data = []
+    library_page = get_library(user_id, is_anime=True, include_related=compound)
+    try:
+        # Commit the new cached responses in batches instead of one transaction per response
+        with WRITE_BATCH.batched():
+            for library_page in iter_library_pages(library_page, limit, prefetch, parallel_pages):
+                # `Executor.map()` returns results in library order regardless of which request finishes first
+                map_entries = executor.map if executor else map
+                resolve = functools.partial(resolve_entry, included_index=index_included(library_page))
+                all_data.extend(map_entries(resolve, library_page['data']))
+    finally:
+        if executor:
+            executor.shutdown()
+
+    store_summary(all_data)
+
+
+async def scrape_kitsu_async_unsafe(username=None, limit=None, concurrency=DEFAULT_CONCURRENCY, compound=False):
+    """Scrape the user's library with the asyncio engine. All entries of a library page are fetched concurrently.
+
+    Args:
+        username: optional Kitsu user name. Otherwise falls back to input()
+        limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+        concurrency: maximum number of concurrent requests. Default is `DEFAULT_CONCURRENCY`
+        compound: if True, resolve related resources from compound library pages. Default is False
+
+    """
+    initialize_cache()
+    if not compound:
+        # Refresh the cached anime in bulk instead of revalidating each entry
+        refresh_stale_anime()
+    user_id = get_user_id(username)
+    LOGGER.debug(f'Scraping Kitsu for {username} ({user_id}) with concurrency={concurrency}')
+
+    HTTP_SESSION.ensure_pool_size(concurrency)
+    semaphore = asyncio.Semaphore(concurrency)
+    asyncio.get_running_loop().set_default_executor(ThreadPoolExecutor(max_workers=concurrency))
+
+    # Loop through a user's library. Entries are gathered in library order
+    index = 0
+    all_data = []
+    library_page = get_library(user_id, is_anime=True, include_related=compound)
+    with WRITE_BATCH.batched():
+        while library_page and (limit is None or index <= limit):
+            # Start the request for the next page before resolving the entries of this page
+            index += 1
+            next_url = next_library_url(library_page, index) if limit is None or index <= limit else None
+            next_page = None
+            if next_url:
+                LOGGER.debug(f'Fetching next library page URL: {next_url}')
+                next_page = asyncio.ensure_future(selective_request_async('library-next', next_url, semaphore))
+
+            included_index = index_included(library_page)
+            tasks = [resolve_entry_async(entry, semaphore, included_index) for entry in library_page['data']]
+            all_data.extend(await asyncio.gather(*tasks))
+            library_page = await next_page if next_page else False
+
+    store_summary(all_data)
+
+
+def scrape_kitsu(username=None, limit=None, workers=None, compound=False, prefetch=DEFAULT_PREFETCH,
+                 parallel_pages=None):
     """Capture log exception from scrape_kitsu_unsafe.
 
     Args:
         username: optional Kitsu user name. Otherwise falls back to input()
         limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+        workers: optional number of threads used to fetch each library entry. Default is sequential
+        compound: if True, resolve related resources from compound library pages. Default is False
+        prefetch: number of library pages to fetch ahead. Default is `DEFAULT_PREFETCH`
+        parallel_pages: optional maximum number of library pages to request concurrently by offset. Default is None
+
+    """
+    configure_logger()
+    try:
+        scrape_kitsu_unsafe(username, limit, workers, compound, prefetch, parallel_pages)
+    except Exception:
+        LOGGER.exception(f'Scraping Kitsu Library for {username} Failed')
+        raise
+
+
+def scrape_kitsu_async(username=None, limit=None, concurrency=DEFAULT_CONCURRENCY, compound=False):
+    """Run the asyncio scraping engine and capture log exception from scrape_kitsu_async_unsafe.
+
+    Args:
+        username: optional Kitsu user name. Otherwise falls back to input()
+        limit: optional maximum number of library pages to request. Useful for initial testing. Default is no limit
+        concurrency: maximum number of concurrent requests. Default is `DEFAULT_CONCURRENCY`
+        compound: if True, resolve related resources from compound library pages. Default is False
 
     """
     configure_logger()
     try:
-        scrape_kitsu_unsafe(username, limit)
+        asyncio.run(scrape_kitsu_async_unsafe(username, limit, concurrency, compound))
     except Exception:
         LOGGER.exception(f'Scraping Kitsu Library for {username} Failed')
         raise
@@ -0,0 +1,152 @@
+"""Helpers for managing the shared HTTP session used for all Kitsu API requests.
+
+Each call to the module-level `requests.get()` creates a new session and pays for a new TCP and TLS handshake. The
+`SessionConnect` class keeps a single `requests.Session` with pooled keep-alive connections instead
+
+```py
+from kitsu_lib.session_helpers import HTTP_SESSION
+
+# Keep more connections open per host when fetching with several workers
+HTTP_SESSION.configure(pool_maxsize=20, host_pool_sizes={'https://media.kitsu.io': 4})
+
+# Or replace the transport entirely (any `requests.adapters.BaseAdapter` subclass)
+HTTP_SESSION.configure(transport=MyAdapter())
+```
+
+Responses are requested with every content encoding that `urllib3` can decode (`gzip` and `deflate`, plus `br` when
+the optional `brotli` package is installed)
+
+"""
+
+import threading
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.request import ACCEPT_ENCODING
+
+from .kitsu_helpers import LOGGER
+
+
+class SessionConnect:
+    """Manage a shared `requests.Session` so that connections are pooled and kept alive between requests."""
+
+    pool_connections = 10
+    """Number of per-host connection pools to cache in each adapter."""
+
+    pool_maxsize = 10
+    """Maximum number of keep-alive connections to store in each per-host pool."""
+
+    host_pool_sizes = None
+    """Optional dictionary of URL prefix to `pool_maxsize` for hosts that need a dedicated pool size."""
+
+    transport = None
+    """Optional `requests` transport adapter to mount for all URLs instead of the default `HTTPAdapter`."""
+
+    headers = None
+    """Additional headers to send with every request."""
+
+    _session = None
+
+    @property
+    def session(self):
+        """Return the shared session. Will create a new session if one does not exist already.
+
+        Returns:
+            requests.Session: session with the configured transport adapters mounted
+
+        """
+        if self._session is None:
+            with self._lock:
+                if self._session is None:
+                    LOGGER.debug(f'Initializing HTTP session (pool_maxsize={self.pool_maxsize})')
+                    self._session = self.create_session()
+        return self._session
+
+    def __init__(self, pool_connections=10, pool_maxsize=10, host_pool_sizes=None, transport=None, headers=None):
+        """Store the session configuration. The session is created on first use.
+
+        Args:
+            pool_connections: number of per-host connection pools to cache. Default is 10
+            pool_maxsize: maximum number of keep-alive connections in each per-host pool. Default is 10
+            host_pool_sizes: optional dictionary of URL prefix to pool size (ex: `{'https://kitsu.io': 20}`)
+            transport: optional `requests` transport adapter to use instead of the default `HTTPAdapter`
+            headers: optional dictionary of headers to send with every request
+
+        """
+        self._lock = threading.Lock()
+        self.pool_connections = pool_connections
+        self.pool_maxsize = pool_maxsize
+        self.host_pool_sizes = host_pool_sizes or {}
+        self.transport = transport
+        self.headers = headers or {}
+
+    def configure(self, **kwargs):
+        """Update the session configuration and close the current session so that the next request uses it.
+
+        Args:
+            kwargs: any keyword argument accepted by `__init__()`
+
+        Raises:
+            TypeError: if an unknown keyword argument is passed
+
+        """
+        unknown = set(kwargs) - {'pool_connections', 'pool_maxsize', 'host_pool_sizes', 'transport', 'headers'}
+        if unknown:
+            raise TypeError(f'Unknown session configuration: {unknown}')
+        self.close()
+        for key, value in kwargs.items():
+            setattr(self, key, value)
+
+    def ensure_pool_size(self, pool_maxsize):
+        """Grow the per-host pool so that concurrent workers do not discard keep-alive connections.
+
+        Args:
+            pool_maxsize: minimum number of keep-alive connections needed in each per-host pool
+
+        """
+        if self.pool_maxsize < pool_maxsize:
+            self.configure(pool_maxsize=pool_maxsize)
+
+    def create_adapter(self, pool_maxsize):
+        """Return a new transport adapter with pooled connections.
+
+        Args:
+            pool_maxsize: maximum number of keep-alive connections in each per-host pool
+
+        Returns:
+            requests.adapters.BaseAdapter: transport adapter to mount on the session
+
+        """
+        return HTTPAdapter(pool_connections=self.pool_connections, pool_maxsize=pool_maxsize, pool_block=False)
+
+    def create_session(self):
+        """Create a new session with the configured transport adapters mounted.
+
+        Returns:
+            requests.Session: new session instance
+
+        """
+        session = requests.Session()
+        session.headers.update({'Connection': 'keep-alive', 'Accept-Encoding': ACCEPT_ENCODING, **self.headers})
+        if self.transport is not None:
+            for scheme in ['https://', 'http://']:
+                session.mount(scheme, self.transport)
+        else:
+            adapter = self.create_adapter(self.pool_maxsize)
+            for scheme in ['https://', 'http://']:
+                session.mount(scheme, adapter)
+            # Longer prefixes take precedence over the scheme-wide adapter in `requests.Session.get_adapter()`
+            for prefix, pool_maxsize in self.host_pool_sizes.items():
+                session.mount(prefix, self.create_adapter(pool_maxsize))
+        return session
+
+    def close(self):
+        """Close all pooled connections. A new session will be created on the next request."""
+        with self._lock:
+            if self._session is not None:
+                self._session.close()
+            self._session = None
+
+
+HTTP_SESSION = SessionConnect()
+"""Global instance of the SessionConnect() shared by all requests to the Kitsu API."""
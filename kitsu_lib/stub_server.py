@@ -0,0 +1,450 @@
+"""Local stand-in for the Kitsu API to run the scraper end-to-end without network access.
+
+The `KitsuStubServer` serves synthetic `users`, `library-entries`, `anime`, and `streaming-links` responses with the
+same JSON:API shapes (paging, `include`, sparse fieldsets, `filter[id]`, and ETags) that the scraper reads. Latency,
+server errors, and rate limiting can be injected to compare fetch strategies under realistic conditions
+
+```py
+from kitsu_lib import api_helpers
+from kitsu_lib.stub_server import KitsuStubServer
+
+with KitsuStubServer(n_entries=200, latency=0.05, error_rate=0.01, rate_limit=50) as server:
+    api_helpers.KITSU_API_URL = server.base_url
+    scrape_kitsu_unsafe(server.username)
+    print(server.stats)
+```
+
+"""
+
+import functools
+import gzip
+import hashlib
+import math
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qsl, urlencode, urlsplit
+
+from .codec_helpers import JSON_CODEC
+from .kitsu_helpers import LOGGER
+
+CATEGORY_SLUGS = ['action', 'adventure', 'comedy', 'drama', 'fantasy', 'horror', 'mecha', 'mystery', 'romance',
+                  'sci-fi', 'slice-of-life', 'sports', 'supernatural', 'thriller']
+"""Category slugs assigned to the synthetic anime."""
+
+STREAM_HOSTS = ['http://www.crunchyroll.com', 'http://www.funimation.com/shows', 'http://www.hulu.com',
+                'https://www.netflix.com/title', 'http://a.co/d']
+"""Stream URL prefixes assigned to the synthetic anime."""
+
+DEFAULT_PAGE_LIMIT = 10
+"""Default number of library entries per page (same as the Kitsu API)."""
+
+MAX_PAGE_LIMIT = 500
+"""Largest accepted `page[limit]` for library entries."""
+
+POLL_INTERVAL = 0.05
+"""Seconds between checks for `stop()`. Shorter than the `serve_forever()` default of 0.5, so the tests run faster."""
+
+
+class KitsuDataset:
+    """Deterministic synthetic library for a single user."""
+
+    def __init__(self, n_entries=100, seed=0, username='stub_user', user_id=1):
+        """Generate the library.
+
+        Args:
+            n_entries: number of anime in the user's library. Default is 100
+            seed: random seed so that repeated runs serve identical data. Default is 0
+            username: user name accepted by `users?filter[name]=`. Default is `stub_user`
+            user_id: ID of the user. Default is 1
+
+        """
+        rand = random.Random(seed)
+        self.username = username
+        self.user_id = str(user_id)
+        self.categories = {str(idx + 1): slug for idx, slug in enumerate(CATEGORY_SLUGS)}
+        self.anime = {}
+        self.anime_categories = {}
+        self.anime_streams = {}
+        self.streams = {}
+        self.entries = []
+        self.entry_anime = {}
+        for idx in range(n_entries):
+            anime_id = str(1000 + idx)
+            self.anime[anime_id] = {
+                'canonicalTitle': f'Stub Anime {idx}',
+                'slug': f'stub-anime-{idx}',
+                'synopsis': f'Synopsis for anime {idx}.\n\nSecond paragraph.',
+                'posterImage': {'original': f'https://media.kitsu.io/anime/poster_images/{anime_id}/original.jpg'},
+                'averageRating': f'{rand.uniform(50, 90):.2f}',
+                'userCount': rand.randint(10, 100000),
+                'favoritesCount': rand.randint(0, 5000),
+                'startDate': f'20{rand.randint(0, 19):02d}-0{rand.randint(1, 9)}-1{rand.randint(0, 9)}',
+                'endDate': None,
+                'nextRelease': None,
+                'popularityRank': rand.randint(1, 10000),
+                'ratingRank': rand.randint(1, 10000),
+                'ageRating': rand.choice(['G', 'PG', 'R']),
+                'status': rand.choice(['finished', 'current']),
+                'episodeCount': rand.randint(1, 50),
+                'episodeLength': 24,
+                'totalLength': None,
+                'showType': rand.choice(['TV', 'movie', 'OVA']),
+                'subtype': 'TV',
+                'titles': {'en': f'Stub Anime {idx}', 'ja_jp': f'スタブ {idx}'},
+                'description': 'Unused attribute that sparse fieldsets should drop. ' * 5,
+            }
+            self.anime_categories[anime_id] = rand.sample([*self.categories], rand.randint(1, 4))
+            stream_ids = []
+            for host in rand.sample(STREAM_HOSTS, rand.randint(0, 3)):
+                stream_id = str(5000 + len(self.streams))
+                self.streams[stream_id] = {'url': f'{host}/stub-anime-{idx}', 'subs': ['en'], 'dubs': ['ja']}
+                stream_ids.append(stream_id)
+            self.anime_streams[anime_id] = stream_ids
+            self.entries.append({
+                'id': str(100000 + idx),
+                'anime_id': anime_id,
+                'attributes': {
+                    'createdAt': '2020-01-01T00:00:00.000Z', 'updatedAt': '2020-02-01T00:00:00.000Z',
+                    'status': rand.choice(['current', 'planned', 'completed', 'on_hold', 'dropped']),
+                    'progress': rand.randint(0, 12), 'notes': None, 'private': False, 'progressedAt': None,
+                    'startedAt': None, 'finishedAt': None, 'ratingTwenty': rand.choice([None, 14, 16, 18]),
+                    'reconsumeCount': 0,
+                },
+            })
+            self.entry_anime[self.entries[-1]['id']] = anime_id
+
+
+class KitsuStubServer:
+    """Threaded HTTP server that serves a `KitsuDataset` with injectable latency, errors, and rate limiting."""
+
+    latency = 0.0
+    """Fixed delay in seconds added to every response."""
+
+    jitter = 0.0
+    """Maximum additional random delay in seconds added to every response."""
+
+    error_rate = 0.0
+    """Fraction of requests (0-1) that fail with `503 Service Unavailable`."""
+
+    rate_limit = None
+    """Optional sustained requests per second. Requests above the limit receive `429 Too Many Requests`."""
+
+    retry_after = 1
+    """Value of the `Retry-After` header sent with `429` responses."""
+
+    def __init__(self, n_entries=100, host='127.0.0.1', port=0, latency=0.0, jitter=0.0, error_rate=0.0,
+                 rate_limit=None, retry_after=1, seed=0):
+        """Create the server. Call `start()` or use as a context manager to serve requests.
+
+        Args:
+            n_entries: number of anime in the synthetic library. Default is 100
+            host: interface to bind. Default is `127.0.0.1`
+            port: port to bind. Default is 0 to pick any free port
+            latency: fixed delay in seconds added to every response. Default is 0
+            jitter: maximum additional random delay in seconds. Default is 0
+            error_rate: fraction of requests that fail with `503`. Default is 0
+            rate_limit: optional sustained requests per second before responding `429`. Default is None (unlimited)
+            retry_after: seconds sent in the `Retry-After` header of `429` responses. Default is 1
+            seed: random seed for the dataset and the injected errors. Default is 0
+
+        """
+        self.dataset = KitsuDataset(n_entries=n_entries, seed=seed)
+        self.latency = latency
+        self.jitter = jitter
+        self.error_rate = error_rate
+        self.rate_limit = rate_limit
+        self.retry_after = retry_after
+        self.stats = {'requests': 0}
+        self._rand = random.Random(seed)
+        self._lock = threading.Lock()
+        self._tokens = float(rate_limit or 0)
+        self._updated = time.monotonic()
+        self._thread = None
+        self.httpd = ThreadingHTTPServer((host, port), _KitsuStubHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.stub = self
+
+    @property
+    def base_url(self):
+        """Return the base URL to use in place of `KITSU_API_URL`.
+
+        Returns:
+            str: base URL of the local API
+
+        """
+        host, port = self.httpd.server_address[:2]
+        return f'http://{host}:{port}/api/edge'
+
+    @property
+    def username(self):
+        """Return the user name of the synthetic library.
+
+        Returns:
+            str: user name
+
+        """
+        return self.dataset.username
+
+    def start(self):
+        """Serve requests from a background thread.
+
+        Returns:
+            KitsuStubServer: this instance
+
+        """
+        serve = functools.partial(self.httpd.serve_forever, poll_interval=POLL_INTERVAL)
+        self._thread = threading.Thread(target=serve, daemon=True)
+        self._thread.start()
+        LOGGER.debug(f'Kitsu stub server listening on {self.base_url}')
+        return self
+
+    def stop(self):
+        """Stop serving requests and close the socket."""
+        self.httpd.shutdown()
+        self.httpd.server_close()
+        if self._thread is not None:
+            self._thread.join()
+
+    def __enter__(self):
+        """Start the server.
+
+        Returns:
+            KitsuStubServer: this instance
+
+        """
+        return self.start()
+
+    def __exit__(self, *_args):
+        """Stop the server."""
+        self.stop()
+
+    def count(self, status):
+        """Count a response in `stats`.
+
+        Args:
+            status: HTTP status code of the response
+
+        """
+        with self._lock:
+            self.stats['requests'] += 1
+            self.stats[status] = self.stats.get(status, 0) + 1
+
+    def inject_failure(self):
+        """Return an injected status code for the next request, if any.
+
+        Returns:
+            int: `429` if rate limited, `503` for an injected error, or None to respond normally
+
+        """
+        with self._lock:
+            if self.rate_limit:
+                now = time.monotonic()
+                self._tokens = min(float(self.rate_limit), self._tokens + (now - self._updated) * self.rate_limit)
+                self._updated = now
+                if self._tokens < 1:
+                    return 429
+                self._tokens -= 1
+            if self.error_rate and self._rand.random() < self.error_rate:
+                return 503
+        return None
+
+    def delay(self):
+        """Sleep for the configured latency and jitter."""
+        with self._lock:
+            wait = self.latency + (self._rand.uniform(0, self.jitter) if self.jitter else 0)
+        if wait > 0:
+            time.sleep(wait)
+
+    # -----------------------------------------------------------------------------------------------------------------
+    # JSON:API documents
+
+    def _anime_resource(self, anime_id, fields, with_data=False):
+        resource = {
+            'id': anime_id, 'type': 'anime', 'links': {'self': f'{self.base_url}/anime/{anime_id}'},
+            'attributes': dict(self.dataset.anime[anime_id]),
+            'relationships': {
+                'categories': {'links': {'related': f'{self.base_url}/anime/{anime_id}/categories'}},
+                'streamingLinks': {'links': {'related': f'{self.base_url}/anime/{anime_id}/streaming-links'}},
+            },
+        }
+        if with_data:
+            resource['relationships']['categories']['data'] = [
+                {'type': 'categories', 'id': cat_id} for cat_id in self.dataset.anime_categories[anime_id]]
+            resource['relationships']['streamingLinks']['data'] = [
+                {'type': 'streamingLinks', 'id': stream_id} for stream_id in self.dataset.anime_streams[anime_id]]
+        return sparse_resource(resource, fields)
+
+    def _category_resource(self, cat_id, fields):
+        resource = {'id': cat_id, 'type': 'categories',
+                    'attributes': {'slug': self.dataset.categories[cat_id], 'title': self.dataset.categories[cat_id]}}
+        return sparse_resource(resource, fields)
+
+    def _stream_resource(self, stream_id, fields):
+        resource = {'id': stream_id, 'type': 'streamingLinks', 'attributes': dict(self.dataset.streams[stream_id])}
+        return sparse_resource(resource, fields)
+
+    def _category_ids(self, anime_ids):
+        unique_ids = {}
+        for anime_id in anime_ids:
+            unique_ids.update(dict.fromkeys(self.dataset.anime_categories[anime_id]))
+        return [*unique_ids]
+
+    def _anime_document(self, anime_ids, query, many=False):
+        fields = parse_fields(query)
+        include = query.get('include', '').split(',')
+        data = [self._anime_resource(anime_id, fields, with_data='categories' in include) for anime_id in anime_ids]
+        doc = {'data': data if many else data[0]}
+        if 'categories' in include:
+            doc['included'] = [self._category_resource(cat_id, fields) for cat_id in self._category_ids(anime_ids)]
+        return doc
+
+    def _library_document(self, path, query):
+        fields = parse_fields(query)
+        limit = min(int(query.get('page[limit]', DEFAULT_PAGE_LIMIT)), MAX_PAGE_LIMIT)
+        offset = int(query.get('page[offset]', 0))
+        entries = self.dataset.entries if query.get('filter[kind]', 'anime') == 'anime' else []
+        page = entries[offset:offset + limit]
+        data = []
+        for entry in page:
+            anime_rel = {'links': {'related': f"{self.base_url}/library-entries/{entry['id']}/anime"}}
+            if 'include' in query:
+                anime_rel['data'] = {'type': 'anime', 'id': entry['anime_id']}
+            resource = {'id': entry['id'], 'type': 'libraryEntries', 'attributes': dict(entry['attributes']),
+                        'relationships': {'anime': anime_rel}}
+            data.append(sparse_resource(resource, fields))
+        doc = {'data': data, 'meta': {'count': len(entries)}, 'links': {}}
+        if offset + limit < len(entries):
+            next_query = {**query, 'page[limit]': str(limit), 'page[offset]': str(offset + limit)}
+            doc['links']['next'] = f'{self.base_url}/{path}?{urlencode(next_query)}'
+        if 'include' in query:
+            anime_ids = [entry['anime_id'] for entry in page]
+            included = [self._anime_resource(anime_id, fields, with_data=True) for anime_id in anime_ids]
+            included.extend(self._category_resource(cat_id, fields) for cat_id in self._category_ids(anime_ids))
+            included.extend(self._stream_resource(stream_id, fields)
+                            for anime_id in anime_ids for stream_id in self.dataset.anime_streams[anime_id])
+            doc['included'] = included
+        return doc
+
+    def route(self, path, query):
+        """Return the JSON:API document for a request.
+
+        Args:
+            path: URL path after `/api/edge/`
+            query: dictionary of query parameters
+
+        Returns:
+            dict: response document or None if the resource does not exist
+
+        """
+        segments = path.strip('/').split('/')
+        if segments == ['users']:
+            if query.get('filter[name]') != self.dataset.username:
+                return {'data': []}
+            return {'data': [{'id': self.dataset.user_id, 'type': 'users', 'attributes': {'name': self.username}}]}
+        if len(segments) == 3 and segments[0] == 'users' and segments[2] == 'library-entries':
+            return self._library_document(path.strip('/'), query) if segments[1] == self.dataset.user_id else None
+        if len(segments) == 3 and segments[0] == 'library-entries' and segments[2] == 'anime':
+            anime_id = self.dataset.entry_anime.get(segments[1])
+            return None if anime_id is None else self._anime_document([anime_id], query)
+        if segments == ['anime']:
+            anime_ids = [anime_id for anime_id in query.get('filter[id]', '').split(',')
+                         if anime_id in self.dataset.anime]
+            return self._anime_document(anime_ids, query, many=True)
+        if len(segments) >= 2 and segments[0] == 'anime' and segments[1] in self.dataset.anime:
+            if len(segments) == 2:
+                return self._anime_document([segments[1]], query)
+            if segments[2] == 'streaming-links':
+                fields = parse_fields(query)
+                return {'data': [self._stream_resource(stream_id, fields)
+                                 for stream_id in self.dataset.anime_streams[segments[1]]]}
+        return None
+
+
+def parse_fields(query):
+    """Parse the JSON:API sparse fieldsets from the query parameters.
+
+    Args:
+        query: dictionary of query parameters
+
+    Returns:
+        dict: resource type to set of field names
+
+    """
+    return {key[len('fields['):-1]: set(value.split(',')) for key, value in query.items() if key.startswith('fields[')}
+
+
+def sparse_resource(resource, fields):
+    """Remove the attributes and relationships not listed in the sparse fieldset for the resource type.
+
+    Args:
+        resource: JSON:API resource object
+        fields: dictionary from `parse_fields()`
+
+    Returns:
+        dict: the filtered resource
+
+    """
+    allowed = fields.get(resource['type'])
+    if allowed is not None:
+        for key in ['attributes', 'relationships']:
+            if key in resource:
+                resource[key] = {name: value for name, value in resource[key].items() if name in allowed}
+    return resource
+
+
+class _KitsuStubHandler(BaseHTTPRequestHandler):
+    """Request handler for the `KitsuStubServer`."""
+
+    protocol_version = 'HTTP/1.1'
+    # The headers and body are written separately, so Nagle's algorithm would add a delayed-ACK stall to each response
+    disable_nagle_algorithm = True
+
+    def log_message(self, format, *args):  # noqa: A002
+        LOGGER.debug(f'Kitsu stub server: {format % args}')
+
+    def send_body(self, status, body, headers=None):
+        if 'gzip' in self.headers.get('Accept-Encoding', '') and body:
+            body = gzip.compress(body)
+            headers = {**(headers or {}), 'Content-Encoding': 'gzip'}
+        self.server.stub.count(status)  # Count first, so `stats` is complete once the client receives the response
+        self.send_response(status)
+        for key, value in (headers or {}).items():
+            self.send_header(key, value)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def send_error_document(self, status, title, headers=None):
+        body = JSON_CODEC.dumps({'errors': [{'title': title, 'status': str(status)}]})
+        self.send_body(status, body, {'Content-Type': 'application/vnd.api+json', **(headers or {})})
+
+    def do_GET(self):  # noqa: N802
+        stub = self.server.stub
+        stub.delay()
+        injected = stub.inject_failure()
+        if injected == 429:
+            retry_after = str(math.ceil(stub.retry_after))
+            self.send_error_document(429, 'Too Many Requests', {'Retry-After': retry_after})
+            return
+        if injected == 503:
+            self.send_error_document(503, 'Service Unavailable')
+            return
+
+        parts = urlsplit(self.path)
+        if not parts.path.startswith('/api/edge/'):
+            self.send_error_document(404, 'Not Found')
+            return
+        doc = stub.route(parts.path[len('/api/edge/'):], dict(parse_qsl(parts.query, keep_blank_values=True)))
+        if doc is None:
+            self.send_error_document(404, 'Not Found')
+            return
+
+        body = JSON_CODEC.dumps(doc)
+        etag = f'"{hashlib.md5(body).hexdigest()}"'  # noqa: S303
+        headers = {'Content-Type': 'application/vnd.api+json', 'ETag': etag}
+        if self.headers.get('If-None-Match') == etag:
+            self.send_body(304, b'', headers)
+        else:
+            self.send_body(200, body, headers)
@@ -0,0 +1,330 @@
+"""Helpers for throttling and retrying requests to the Kitsu API.
+
+The `RATE_LIMITER`, `RETRY_POLICY`, and `CIRCUIT_BREAKER` are shared by every fetcher (sync, threaded, and asyncio
+engines all call `request_data()`), so the configured limits apply to the whole process
+
+```py
+from kitsu_lib.throttle_helpers import CIRCUIT_BREAKER, RATE_LIMITER, RETRY_POLICY
+
+RATE_LIMITER.configure(rate=20, burst=40)
+RETRY_POLICY.configure(max_attempts=8, max_delay=60)
+CIRCUIT_BREAKER.configure(failure_threshold=10, cooldown=120)
+```
+
+"""
+
+import random
+import threading
+import time
+from email.utils import parsedate_to_datetime
+from json.decoder import JSONDecodeError
+
+from requests import exceptions
+
+from .kitsu_helpers import LOGGER
+
+
+def parse_retry_after(value):
+    """Parse the value of a `Retry-After` header.
+
+    Args:
+        value: header value as either a number of seconds or an HTTP date. May be None
+
+    Returns:
+        float: number of seconds to wait or None if the value could not be parsed
+
+    """
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        LOGGER.warning(f'Could not parse Retry-After header: {value}')
+    return None
+
+
+class RateLimiter:
+    """Thread-safe token bucket that adapts the request rate to the responses from the API.
+
+    Tokens refill at the current rate up to `burst`. A throttled response (`429`) halves the current rate and pauses all
+    callers for the `Retry-After` duration. Each successful response then increases the rate additively until it is
+    back at the configured maximum
+
+    """
+
+    max_rate = 10.0
+    """Configured sustained rate in requests per second. The adaptive rate will never exceed this value."""
+
+    burst = 20
+    """Maximum number of requests that can be made back-to-back after an idle period."""
+
+    min_rate = 0.5
+    """Lower bound for the adaptive rate in requests per second."""
+
+    backoff_factor = 0.5
+    """Multiplier applied to the current rate on each throttled response."""
+
+    recovery_step = 0.1
+    """Requests per second added to the current rate after each successful response."""
+
+    def __init__(self, rate=10.0, burst=20, min_rate=0.5, backoff_factor=0.5, recovery_step=0.1):
+        """Initialize a full bucket.
+
+        Args:
+            rate: sustained rate in requests per second. Default is 10
+            burst: maximum number of back-to-back requests. Default is 20
+            min_rate: lower bound for the adaptive rate. Default is 0.5
+            backoff_factor: multiplier applied to the rate when throttled. Default is 0.5
+            recovery_step: requests per second added back after each success. Default is 0.1
+
+        """
+        self._lock = threading.Lock()
+        self.configure(rate=rate, burst=burst, min_rate=min_rate, backoff_factor=backoff_factor,
+                       recovery_step=recovery_step)
+
+    def configure(self, rate=None, burst=None, min_rate=None, backoff_factor=None, recovery_step=None):
+        """Update the limiter settings and reset the bucket. Arguments left as None are unchanged.
+
+        Args:
+            rate: sustained rate in requests per second
+            burst: maximum number of back-to-back requests
+            min_rate: lower bound for the adaptive rate
+            backoff_factor: multiplier applied to the rate when throttled
+            recovery_step: requests per second added back after each success
+
+        """
+        with self._lock:
+            self.max_rate = self.max_rate if rate is None else float(rate)
+            self.burst = self.burst if burst is None else burst
+            self.min_rate = self.min_rate if min_rate is None else min_rate
+            self.backoff_factor = self.backoff_factor if backoff_factor is None else backoff_factor
+            self.recovery_step = self.recovery_step if recovery_step is None else recovery_step
+            self.rate = self.max_rate
+            self._tokens = float(self.burst)
+            self._updated = time.monotonic()
+            self._blocked_until = 0.0
+
+    def _refill(self, now):
+        """Add the tokens earned since the last update. Must be called with the lock held.
+
+        No tokens are earned during a pause, so callers queued during the pause are spaced at the reduced rate after it
+
+        Args:
+            now: current `time.monotonic()` value
+
+        """
+        self._tokens = min(float(self.burst), self._tokens + max(0.0, now - self._updated) * self.rate)
+        self._updated = max(now, self._blocked_until)
+
+    def reserve(self):
+        """Take one token and return how long the caller must wait before using it.
+
+        Tokens may go negative so that concurrent callers queue up behind each other instead of all waking at once
+
+        Returns:
+            float: number of seconds to wait
+
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self._tokens -= 1
+            debt_wait = -self._tokens / self.rate if self._tokens < 0 else 0.0
+            # Tokens are only earned again from `_updated`, which is the end of any pause
+            return self._updated - now + debt_wait
+
+    def acquire(self):
+        """Block until a request can be made."""
+        wait = self.reserve()
+        if wait > 0:
+            time.sleep(wait)
+
+    def penalize(self, retry_after=None):
+        """Reduce the rate and pause all callers after a throttled response.
+
+        Args:
+            retry_after: optional number of seconds from the `Retry-After` header. Default is one token interval
+
+        """
+        with self._lock:
+            now = time.monotonic()
+            self._refill(now)
+            self.rate = max(self.min_rate, self.rate * self.backoff_factor)
+            pause = retry_after if retry_after is not None else 1 / self.rate
+            self._blocked_until = max(self._blocked_until, now + pause)
+            self._updated = self._blocked_until
+            self._tokens = min(self._tokens, 0.0)
+            LOGGER.warning(f'Throttled by API. Pausing {pause:.2f}s and reducing rate to {self.rate:.2f} req/s')
+
+    def reward(self):
+        """Increase the rate after a successful response, up to the configured maximum."""
+        with self._lock:
+            if self.rate < self.max_rate:
+                now = time.monotonic()
+                self._refill(now)
+                self.rate = min(self.max_rate, self.rate + self.recovery_step)
+
+
+RATE_LIMITER = RateLimiter()
+"""Global instance of the RateLimiter() shared by all requests to the Kitsu API."""
+
+
+class RetryPolicy:
+    """Settings for retrying transient failures with jittered exponential backoff."""
+
+    max_attempts = 5
+    """Maximum number of attempts for a single request, including the first."""
+
+    base_delay = 0.5
+    """Delay in seconds before the first retry. Doubled for each subsequent attempt."""
+
+    max_delay = 30.0
+    """Upper bound in seconds for the delay between attempts."""
+
+    retryable_status = frozenset({429, 500, 502, 503, 504})
+    """HTTP status codes that are retried."""
+
+    retryable_errors = (exceptions.ConnectionError, exceptions.Timeout, exceptions.ChunkedEncodingError,
+                        exceptions.ContentDecodingError, JSONDecodeError)
+    """Exceptions that are retried. Includes truncated bodies that fail to decode."""
+
+    def __init__(self, max_attempts=5, base_delay=0.5, max_delay=30.0, retryable_status=None):
+        """Store the retry settings.
+
+        Args:
+            max_attempts: maximum number of attempts for a single request. Default is 5
+            base_delay: delay in seconds before the first retry. Default is 0.5
+            max_delay: upper bound in seconds for the delay between attempts. Default is 30
+            retryable_status: optional set of HTTP status codes to retry. Default is `{429, 500, 502, 503, 504}`
+
+        """
+        self.configure(max_attempts=max_attempts, base_delay=base_delay, max_delay=max_delay,
+                       retryable_status=retryable_status)
+
+    def configure(self, max_attempts=None, base_delay=None, max_delay=None, retryable_status=None):
+        """Update the retry settings. Arguments left as None are unchanged.
+
+        Args:
+            max_attempts: maximum number of attempts for a single request
+            base_delay: delay in seconds before the first retry
+            max_delay: upper bound in seconds for the delay between attempts
+            retryable_status: set of HTTP status codes to retry
+
+        """
+        self.max_attempts = self.max_attempts if max_attempts is None else max_attempts
+        self.base_delay = self.base_delay if base_delay is None else base_delay
+        self.max_delay = self.max_delay if max_delay is None else max_delay
+        self.retryable_status = self.retryable_status if retryable_status is None else frozenset(retryable_status)
+
+    def delay(self, attempt):
+        """Return the delay before the next attempt using "full jitter" exponential backoff.
+
+        Args:
+            attempt: number of the attempt that just failed (starting at 1)
+
+        Returns:
+            float: number of seconds to wait
+
+        """
+        return random.uniform(0, min(self.max_delay, self.base_delay * 2 ** (attempt - 1)))  # noqa: S311
+
+
+RETRY_POLICY = RetryPolicy()
+"""Global instance of the RetryPolicy() used for all requests to the Kitsu API."""
+
+
+class CircuitBreaker:
+    """Pause all requests after repeated consecutive failures so that a struggling API can recover.
+
+    When `failure_threshold` consecutive requests fail, the circuit opens and every caller of `wait()` blocks for
+    `cooldown` seconds. The circuit is then half-open: a single caller is allowed through as a probe while the others
+    keep waiting. A success closes the circuit and releases every caller, while a failure opens it again for another
+    cooldown. If the probe records neither (such as for a throttled response), another probe is allowed after `cooldown`
+
+    """
+
+    failure_threshold = 5
+    """Number of consecutive failures that opens the circuit."""
+
+    cooldown = 30.0
+    """Number of seconds to pause all requests while the circuit is open."""
+
+    def __init__(self, failure_threshold=5, cooldown=30.0):
+        """Initialize a closed circuit.
+
+        Args:
+            failure_threshold: number of consecutive failures that opens the circuit. Default is 5
+            cooldown: number of seconds to pause all requests while open. Default is 30
+
+        """
+        self._condition = threading.Condition()
+        self.configure(failure_threshold=failure_threshold, cooldown=cooldown)
+
+    def configure(self, failure_threshold=None, cooldown=None):
+        """Update the circuit breaker settings and close the circuit. Arguments left as None are unchanged.
+
+        Args:
+            failure_threshold: number of consecutive failures that opens the circuit
+            cooldown: number of seconds to pause all requests while open
+
+        """
+        with self._condition:
+            self.failure_threshold = self.failure_threshold if failure_threshold is None else failure_threshold
+            self.cooldown = self.cooldown if cooldown is None else cooldown
+            self._failures = 0
+            self._open_until = 0.0
+            self._half_open = False
+            self._probe_started = None
+            self._condition.notify_all()
+
+    @property
+    def is_open(self):
+        """Return True while requests are paused.
+
+        Returns:
+            bool: True if the circuit is open
+
+        """
+        return time.monotonic() < self._open_until
+
+    def wait(self):
+        """Block until the circuit is closed or the caller is allowed through as the half-open probe."""
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                if now < self._open_until:
+                    self._condition.wait(self._open_until - now)
+                elif not self._half_open:
+                    return
+                elif self._probe_started is None or now - self._probe_started >= self.cooldown:
+                    self._probe_started = now
+                    LOGGER.debug('Circuit breaker half-open. Allowing a single probe request')
+                    return
+                else:
+                    self._condition.wait(self._probe_started + self.cooldown - now)
+
+    def record_success(self):
+        """Close the circuit after a successful request and release the waiting callers."""
+        with self._condition:
+            self._failures = 0
+            self._half_open = False
+            self._probe_started = None
+            self._condition.notify_all()
+
+    def record_failure(self):
+        """Count a failed request and open the circuit if the threshold is reached or the half-open probe failed."""
+        with self._condition:
+            self._failures += 1
+            if (self._failures >= self.failure_threshold or self._half_open) and not self.is_open:
+                self._open_until = time.monotonic() + self.cooldown
+                self._half_open = True
+                self._probe_started = None
+                LOGGER.warning(f'Circuit breaker open. Pausing all requests for {self.cooldown:.1f}s')
+
+
+CIRCUIT_BREAKER = CircuitBreaker()
+"""Global instance of the CircuitBreaker() shared by all requests to the Kitsu API."""
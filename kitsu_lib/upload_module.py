@@ -83,7 +83,8 @@ class UploadModule(ModuleBase):
 
     def initialize_database(self):
         """Create data members `self.database` and `self.user_table`."""
-        self.database = DBConnect(CACHE_DIR / f'_placeholder_app-{self.name}.db')
+        # Uploaded data cannot be downloaded again, so wait for each commit to reach the disk
+        self.database = DBConnect(CACHE_DIR / f'_placeholder_app-{self.name}.db', pragmas={'synchronous': 'full'})
         self.user_table = self.database.db.create_table(
             'users', primary_id='username', primary_type=self.database.db.types.text)
         self.inventory_table = self.database.db.create_table(
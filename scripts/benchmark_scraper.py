@@ -0,0 +1,131 @@
+"""Benchmark the fetch strategies end-to-end against a local stand-in for the Kitsu API.
+
+Each strategy scrapes the same synthetic library from a fresh `KitsuStubServer` (so every run starts with a cold
+cache) and reports the throughput and the p50/p95 latency of each HTTP fetch. Responses are cached in a temporary
+directory unless `KITSU_CACHE_DIR` is set
+
+Example: `poetry run python scripts/benchmark_scraper.py --entries 300 --latency 0.05 --error-rate 0.01`
+
+"""
+
+import argparse
+import asyncio
+import os
+import tempfile
+import threading
+import time
+
+os.environ.setdefault('KITSU_CACHE_DIR', tempfile.mkdtemp(prefix='kitsu_benchmark_'))
+
+from requests.adapters import HTTPAdapter  # noqa: E402
+
+from kitsu_lib import api_helpers, scraper  # noqa: E402
+from kitsu_lib.session_helpers import HTTP_SESSION  # noqa: E402
+from kitsu_lib.stub_server import KitsuStubServer  # noqa: E402
+from kitsu_lib.throttle_helpers import CIRCUIT_BREAKER, RATE_LIMITER  # noqa: E402
+
+STRATEGIES = {
+    'sequential': (scraper.scrape_kitsu_unsafe, {}),
+    'workers': (scraper.scrape_kitsu_unsafe, {'workers': 8}),
+    'async': (scraper.scrape_kitsu_async_unsafe, {'concurrency': 8}),
+    'compound': (scraper.scrape_kitsu_unsafe, {'compound': True}),
+}
+"""Scraper function and keyword arguments for each fetch strategy."""
+
+
+class TimingAdapter(HTTPAdapter):
+    """HTTP transport that records the time to receive the response headers for each request."""
+
+    def __init__(self, **kwargs):  # noqa: D107
+        super().__init__(**kwargs)
+        self.latencies = []
+        self._lock = threading.Lock()
+
+    def send(self, request, **kwargs):  # noqa: D102
+        start = time.perf_counter()
+        response = super().send(request, **kwargs)
+        with self._lock:
+            self.latencies.append(time.perf_counter() - start)
+        return response
+
+
+def percentile(values, fraction):
+    """Return the nearest-rank percentile.
+
+    Args:
+        values: list of numbers
+        fraction: percentile as a fraction between 0 and 1
+
+    Returns:
+        float: value at the percentile or 0 if there are no values
+
+    """
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, round(fraction * len(ordered)) - 1))]
+
+
+def run_strategy(name, args):
+    """Scrape the synthetic library with one strategy and return a summary.
+
+    Args:
+        name: key in `STRATEGIES`
+        args: parsed command line arguments
+
+    Returns:
+        dict: summary of the run
+
+    """
+    scrape, kwargs = STRATEGIES[name]
+    server = KitsuStubServer(n_entries=args.entries, latency=args.latency, jitter=args.jitter,
+                             error_rate=args.error_rate, rate_limit=args.rate_limit, seed=args.seed)
+    transport = TimingAdapter(pool_maxsize=16)
+    HTTP_SESSION.configure(transport=transport)
+    RATE_LIMITER.configure(rate=args.client_rate, burst=args.client_rate)
+    CIRCUIT_BREAKER.configure()
+    with server:
+        api_helpers.KITSU_API_URL = server.base_url
+        start = time.perf_counter()
+        if asyncio.iscoroutinefunction(scrape):
+            asyncio.run(scrape(server.username, **kwargs))
+        else:
+            scrape(server.username, **kwargs)
+        elapsed = time.perf_counter() - start
+    HTTP_SESSION.close()
+    return {
+        'strategy': name,
+        'seconds': elapsed,
+        'requests': len(transport.latencies),
+        'req/s': len(transport.latencies) / elapsed,
+        'entries/s': args.entries / elapsed,
+        'p50 ms': percentile(transport.latencies, 0.5) * 1000,
+        'p95 ms': percentile(transport.latencies, 0.95) * 1000,
+        '429s': server.stats.get(429, 0),
+        '503s': server.stats.get(503, 0),
+    }
+
+
+def main():
+    """Parse the command line arguments and print a table with one row per strategy."""
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[0])
+    parser.add_argument('--entries', type=int, default=200, help='number of anime in the synthetic library')
+    parser.add_argument('--latency', type=float, default=0.02, help='server latency per request in seconds')
+    parser.add_argument('--jitter', type=float, default=0.01, help='maximum random latency added per request')
+    parser.add_argument('--error-rate', type=float, default=0.0, help='fraction of requests that fail with 503')
+    parser.add_argument('--rate-limit', type=float, default=None, help='server requests per second before 429')
+    parser.add_argument('--client-rate', type=float, default=1000, help='client RATE_LIMITER requests per second')
+    parser.add_argument('--seed', type=int, default=0, help='random seed for the synthetic data and errors')
+    parser.add_argument('--strategies', nargs='+', default=[*STRATEGIES], choices=[*STRATEGIES])
+    args = parser.parse_args()
+
+    print(f"Caching responses in: {os.environ['KITSU_CACHE_DIR']}")
+    rows = [run_strategy(name, args) for name in args.strategies]
+    columns = [*rows[0]]
+    print(' | '.join(f'{column:>10}' for column in columns))
+    for row in rows:
+        print(' | '.join(f'{value:>10.1f}' if isinstance(value, float) else f'{value:>10}' for value in row.values()))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,6 @@
+"""Move cached responses from JSON files into the lookup database (`poetry run python scripts/migrate_cache.py`)."""
+
+from kitsu_lib.cache_helpers import migrate_files_to_blobs
+
+if __name__ == '__main__':
+    migrate_files_to_blobs()
@@ -1,3 +1,110 @@
 """PyTest configuration."""
 
+import pytest
 from dash_dev.conftest import pytest_configure  # noqa: F401
+from kitsu_lib import analysis, api_helpers, cache_helpers, scraper
+from kitsu_lib.cache_helpers import MEMORY_CACHE, WRITE_BATCH, DBConnect, initialize_cache
+from kitsu_lib.flight_helpers import BACKGROUND_REFRESH
+from kitsu_lib.stub_server import KitsuStubServer
+from kitsu_lib.throttle_helpers import CircuitBreaker, RateLimiter, RetryPolicy
+
+
+def _isolate_cache(directory, monkeypatch):
+    """Point the cache and the Kitsu database to new files in the directory.
+
+    Args:
+        directory: temporary cache directory
+        monkeypatch: pytest fixture
+
+    Returns:
+        tuple: the DBConnect() for the file lookup database and for the Kitsu database
+
+    """
+    file_data = DBConnect(directory / '_file_lookup_database.db', shared=True)
+    kitsu_data = DBConnect(directory / '_kitsu_data.db')
+    monkeypatch.setattr(cache_helpers, 'CACHE_DIR', directory)
+    monkeypatch.setattr(cache_helpers, 'RESPONSE_DIR', directory / 'responses')
+    monkeypatch.setattr(cache_helpers, 'FILE_DATA', file_data)
+    monkeypatch.setattr(cache_helpers, 'KITSU_DATA', kitsu_data)
+    monkeypatch.setattr(api_helpers, 'FILE_DATA', file_data)
+    monkeypatch.setattr(analysis, 'KITSU_DATA', kitsu_data)
+    monkeypatch.setattr(scraper, 'CACHE_DIR', directory)
+    monkeypatch.setattr(scraper, 'KITSU_DATA', kitsu_data)
+    MEMORY_CACHE.clear()
+    return file_data, kitsu_data
+
+
+def _close_cache(file_data, kitsu_data):
+    """Commit any buffered rows and close the databases from `_isolate_cache()`.
+
+    Args:
+        file_data: DBConnect() for the file lookup database
+        kitsu_data: DBConnect() for the Kitsu database
+
+    """
+    BACKGROUND_REFRESH.wait()
+    WRITE_BATCH.configure(max_rows=0)
+    MEMORY_CACHE.clear()
+    file_data.db.close()
+    kitsu_data.db.close()
+
+
+@pytest.fixture()
+def kitsu_cache(tmp_path, monkeypatch):
+    """Store cached responses and the Kitsu database in a temporary directory.
+
+    Args:
+        tmp_path: pytest fixture
+        monkeypatch: pytest fixture
+
+    Yields:
+        Path: temporary cache directory
+
+    """
+    databases = _isolate_cache(tmp_path, monkeypatch)
+    initialize_cache()
+    yield tmp_path
+    _close_cache(*databases)
+
+
+@pytest.fixture()
+def legacy_cache(tmp_path, monkeypatch):
+    """Create a temporary file lookup database in the format of older versions without calling `initialize_cache()`.
+
+    The `files` table only has the `filename`, `url`, and `timestamp` columns and no index on the URL
+
+    Args:
+        tmp_path: pytest fixture
+        monkeypatch: pytest fixture
+
+    Yields:
+        Path: temporary cache directory
+
+    """
+    databases = _isolate_cache(tmp_path, monkeypatch)
+    table = databases[0].db.create_table('files')
+    table.create_column('filename', databases[0].db.types.text)
+    table.create_column('url', databases[0].db.types.text)
+    table.create_column('timestamp', databases[0].db.types.float)
+    yield tmp_path
+    _close_cache(*databases)
+
+
+@pytest.fixture()
+def stub_api(kitsu_cache, monkeypatch):
+    """Send the Kitsu API requests to a `KitsuStubServer` with 30 library entries and no client-side rate limit.
+
+    Args:
+        kitsu_cache: fixture that isolates the cache
+        monkeypatch: pytest fixture
+
+    Yields:
+        KitsuStubServer: running server. Attributes such as `error_rate` can be changed by the test
+
+    """
+    monkeypatch.setattr(api_helpers, 'RATE_LIMITER', RateLimiter(rate=1000, burst=1000))
+    monkeypatch.setattr(api_helpers, 'RETRY_POLICY', RetryPolicy(base_delay=0.01, max_delay=0.05))
+    monkeypatch.setattr(api_helpers, 'CIRCUIT_BREAKER', CircuitBreaker())
+    with KitsuStubServer(n_entries=30) as server:
+        monkeypatch.setattr(api_helpers, 'KITSU_API_URL', server.base_url)
+        yield server
@@ -1,7 +1,233 @@
 """Test the api_helpers.py file."""
 
-from kitsu_lib.api_helpers import (get_anime, get_data, get_kitsu, get_library, get_streams, get_user, get_user_id,
-                                   selective_request)
+import copy
+import io
+import json
+import logging
+import time
+from json.decoder import JSONDecodeError
+
+import pytest
+import requests
+from kitsu_lib import api_helpers, cache_helpers
+from kitsu_lib.api_helpers import (ANIME_PAGE_LIMIT, MAX_LOGGED_BODY, add_query, anime_url, cache_request_result,
+                                   conditional_headers, decode_response, get_anime, get_anime_by_id, get_anime_many,
+                                   get_data, get_kitsu, get_library, get_streams, get_user, get_user_id,
+                                   index_included, refresh_stale_anime, request_data, selective_request,
+                                   sparse_fields, split_library_entry)
+from kitsu_lib.cache_helpers import CACHE_POLICY, MEMORY_CACHE, match_url_in_cache, match_urls_before, store_response
+from kitsu_lib.flight_helpers import BACKGROUND_REFRESH
+from kitsu_lib.session_helpers import SessionConnect
+from requests.adapters import HTTPAdapter
+
+from .configuration import TEST_DATA_DIR
+
+LIB_ENTRY = json.loads((TEST_DATA_DIR / 'lib_entry.json').read_text())
+"""Example lib_entry response."""
+
+STREAMS = json.loads((TEST_DATA_DIR / 'streams.json').read_text())
+"""Example streams response."""
+
+ANIME = json.loads((TEST_DATA_DIR / 'anime.json').read_text())
+"""Example anime response."""
+
+
+def test_anime_url():
+    """Verify that the include and sparse fieldsets are part of the anime URL (and therefore the cache key)."""
+    link = 'https://kitsu.io/api/edge/library-entries/36121977/anime'
+
+    url = anime_url(link)  # act
+
+    assert url.startswith(f'{link}?include=categories&fields[anime]=canonicalTitle,slug,')
+    assert url.endswith('&fields[categories]=slug')
+    assert anime_url(link, sparse=False) == f'{link}?include=categories'
+    assert add_query(f'{link}?a=1', sparse_fields('streamingLinks')) == f'{link}?a=1&fields[streamingLinks]=url'
+
+
+def test_conditional_headers():
+    """Verify that the stored validators are sent as conditional request headers."""
+    row = {'url': 'https://kitsu.io/api/edge/anime/1', 'etag': 'W/"abc"', 'last_modified': None}
+
+    headers = conditional_headers(row)  # act
+
+    assert headers == {'If-None-Match': 'W/"abc"'}
+    assert conditional_headers(None) == {}
+
+
+def test_cache_request_result_not_modified(kitsu_cache):
+    """Verify that a `304` without a cached response raises an error instead of caching `null`."""
+    url = 'https://kitsu.io/api/edge/anime/1'
+    raw = requests.Response()
+    raw.status_code = 304
+
+    with pytest.raises(RuntimeError, match='no cached response'):
+        cache_request_result('anime', url, None, None, raw)  # act
+
+    assert match_url_in_cache(url) == []
+
+
+@pytest.mark.parametrize('body', [b'<html>' + b'x' * 3 * MAX_LOGGED_BODY, b'\xff' * 3 * MAX_LOGGED_BODY])
+def test_decode_response_error(caplog, body):
+    """Verify that an undecodable body raises a JSONDecodeError and only the start of the body is logged."""
+    raw = requests.Response()
+    raw.raw = io.BytesIO(body)
+    raw.url = 'https://kitsu.io/api/edge/anime/1'
+
+    with caplog.at_level(logging.DEBUG, logger='kitsu'):
+        with pytest.raises(JSONDecodeError):
+            decode_response(raw)  # act
+
+    message = caplog.records[-1].getMessage()
+    assert f'({len(body)} bytes total)' in message
+    assert len(message) < MAX_LOGGED_BODY + 500
+    assert raw.url in message
+
+
+def test_request_data_gzip(stub_api):
+    """Verify that a gzip encoded response from the stub server is decoded."""
+    resp, raw = request_data(f'{stub_api.base_url}/anime/1000')  # act
+
+    assert raw.headers['Content-Encoding'] == 'gzip'
+    assert resp['data']['id'] == '1000'
+    assert stub_api.stats == {'requests': 1, 200: 1}
+
+
+class _FailingAdapter(HTTPAdapter):
+    """Transport adapter that raises a connection error for the first requests."""
+
+    def __init__(self, failures):  # noqa: D107
+        super().__init__()
+        self.failures = failures
+
+    def send(self, request, **kwargs):  # noqa: D102
+        if self.failures:
+            self.failures -= 1
+            raise requests.exceptions.ConnectionError('Connection reset by peer')
+        return super().send(request, **kwargs)
+
+
+def test_request_data_retries(stub_api, monkeypatch):
+    """Verify that connection errors are retried and counted by the circuit breaker."""
+    monkeypatch.setattr(api_helpers, 'HTTP_SESSION', SessionConnect(transport=_FailingAdapter(failures=2)))
+
+    resp, raw = request_data(f'{stub_api.base_url}/anime/1000')  # act
+
+    assert raw.status_code == 200
+    assert resp['data']['id'] == '1000'
+    assert stub_api.stats == {'requests': 1, 200: 1}
+    assert api_helpers.CIRCUIT_BREAKER._failures == 0
+
+
+def test_request_data_retries_exhausted(stub_api):
+    """Verify that the last error is raised once every attempt received a retryable status."""
+    stub_api.error_rate = 1.0
+
+    with pytest.raises(requests.exceptions.HTTPError, match='503'):
+        request_data(f'{stub_api.base_url}/anime/1000')  # act
+
+    assert stub_api.stats == {'requests': api_helpers.RETRY_POLICY.max_attempts, 503: 5}
+
+
+def _ref(resource):
+    """Return the JSON:API resource identifier for a resource object."""  # noqa: DAR101,DAR201
+    return {'type': resource['type'], 'id': resource['id']}
+
+
+def test_split_library_entry():
+    """Verify that the anime and streams are resolved from a compound library page."""
+    anime_data = copy.deepcopy(ANIME['data'])
+    anime_data['relationships']['categories']['data'] = [_ref(category) for category in ANIME['included']]
+    anime_data['relationships']['streamingLinks']['data'] = [_ref(stream) for stream in STREAMS['data']]
+    library_page = copy.deepcopy(LIB_ENTRY)
+    anime_entry = library_page['data'][0]
+    anime_entry['relationships']['anime']['data'] = _ref(anime_data)
+    library_page['included'] = [anime_data, *ANIME['included'], *STREAMS['data']]
+
+    anime, streams = split_library_entry(anime_entry, index_included(library_page))  # act
+
+    assert anime['data'] == anime_data
+    assert anime['included'] == ANIME['included']
+    assert streams == {'data': STREAMS['data']}
+
+
+def test_get_library_page_limit(stub_api):
+    """Verify that the page limit is part of the request URL and of the cache key, unless it is None."""
+    user_id = get_user_id(stub_api.username)
+
+    library_page = get_library(user_id)  # act
+
+    assert len(library_page['data']) == 30
+    assert len(get_library(user_id, page_limit=None)['data']) == 10
+    urls = [row['url'] for row in match_urls_before('%/library-entries?%', time.time() + 1)]
+    assert len(urls) == 2
+    assert len([url for url in urls if 'page[limit]=500' in url]) == 1
+    assert len([url for url in urls if 'page[limit]' not in url]) == 1
+    assert stub_api.stats == {'requests': 3, 200: 3}
+
+
+def test_selective_request_stale_refresh(stub_api, monkeypatch):
+    """Verify that a stale response read from SQLite is returned right away and revalidated in the background."""
+    monkeypatch.setattr(CACHE_POLICY, 'ttl', {'user': 60})
+    user = get_user(stub_api.username)
+    url = match_url_in_cache(f'{stub_api.base_url}/users?filter[name]={stub_api.username}')[0]['url']
+    stale_timestamp = time.time() - 120
+    cache_helpers.FILE_DATA.db.load_table('files').update({'url': url, 'timestamp': stale_timestamp}, ['url'])
+    MEMORY_CACHE.clear()
+
+    result = get_user(stub_api.username)  # act
+
+    assert result == user
+    BACKGROUND_REFRESH.wait()
+    assert stub_api.stats == {'requests': 2, 200: 1, 304: 1}
+    assert match_url_in_cache(url)[0]['timestamp'] > stale_timestamp + 60
+
+
+def test_get_anime_many(stub_api):
+    """Verify that anime are requested in batches of `ANIME_PAGE_LIMIT` IDs and cached for `get_anime_by_id()`."""
+    anime_ids = [str(1000 + idx) for idx in range(ANIME_PAGE_LIMIT + 5)] + ['1']
+
+    anime_by_id = get_anime_many(anime_ids)  # act
+
+    assert [*anime_by_id] == anime_ids[:-1]
+    assert stub_api.stats == {'requests': 2, 200: 2}
+    assert get_anime_by_id('1003') == anime_by_id['1003']
+    assert stub_api.stats['requests'] == 2
+    row = match_url_in_cache(anime_url(f'{stub_api.base_url}/anime/1003'))[0]
+    assert row['etag'] is None
+    assert conditional_headers(row) == {}
+
+
+def test_refresh_stale_anime(stub_api):
+    """Verify that stale anime responses for the library entries are refreshed with bulk requests."""
+    links = [f'{stub_api.base_url}/library-entries/{100000 + idx}/anime' for idx in range(25)]
+    anime = [get_anime(link) for link in links]
+    cache_helpers.FILE_DATA.db.query(f'UPDATE files SET timestamp = {time.time() - 7.5 * 24 * 3600}')
+    MEMORY_CACHE.clear()
+
+    count = refresh_stale_anime()  # act
+
+    assert count == 25
+    assert stub_api.stats['requests'] == 25 + 2
+    assert [get_anime(link) for link in links] == anime
+    BACKGROUND_REFRESH.wait()
+    assert stub_api.stats['requests'] == 25 + 2
+    assert refresh_stale_anime() == 0
+
+
+def test_refresh_stale_anime_without_data(stub_api):
+    """Verify that stale cached responses without an anime are skipped instead of stopping the refresh."""
+    links = [f'{stub_api.base_url}/library-entries/{100000 + idx}/anime' for idx in range(3)]
+    get_anime(links[0])
+    store_response('anime', anime_url(links[1]), {'errors': [{'title': 'Not Found', 'status': '404'}]})
+    store_response('anime', anime_url(links[2]), {'data': None})
+    cache_helpers.FILE_DATA.db.query(f'UPDATE files SET timestamp = {time.time() - 7.5 * 24 * 3600}')
+    MEMORY_CACHE.clear()
+
+    count = refresh_stale_anime()  # act
+
+    assert count == 1
+    assert stub_api.stats == {'requests': 2, 200: 2}
+
 
 # def test_get_data():
 #     """Test get_data with simple smoke test."""
@@ -0,0 +1,47 @@
+"""Test the async_helpers.py file."""
+
+import asyncio
+import time
+
+from kitsu_lib import cache_helpers
+from kitsu_lib.api_helpers import get_anime, get_library, get_streams, get_user_id
+from kitsu_lib.async_helpers import get_anime_async, get_streams_async, selective_request_async
+from kitsu_lib.cache_helpers import CACHE_POLICY, MEMORY_CACHE, match_url_in_cache
+from kitsu_lib.flight_helpers import BACKGROUND_REFRESH
+
+# async def selective_request_async(prefix, url, semaphore=None, revalidate=None, **get_kwargs):
+# async def get_anime_async(anime_link, semaphore=None, sparse=True):
+# async def get_streams_async(stream_link, semaphore=None, sparse=True):
+
+
+def test_selective_request_async_stale_refresh(stub_api, monkeypatch):
+    """Verify that a stale response read from SQLite is returned right away and revalidated in the background."""
+    monkeypatch.setattr(CACHE_POLICY, 'ttl', {'anime': 60})
+    url = f'{stub_api.base_url}/anime/1000'
+    anime = asyncio.run(selective_request_async('anime', url))
+    stale_timestamp = time.time() - 120
+    cache_helpers.FILE_DATA.db.load_table('files').update({'url': url, 'timestamp': stale_timestamp}, ['url'])
+    MEMORY_CACHE.clear()
+
+    result = asyncio.run(selective_request_async('anime', url))  # act
+
+    assert result == anime
+    BACKGROUND_REFRESH.wait()
+    assert stub_api.stats == {'requests': 2, 200: 1, 304: 1}
+    assert match_url_in_cache(url)[0]['timestamp'] > stale_timestamp + 60
+
+
+def test_get_anime_and_streams_async(stub_api):
+    """Verify that the async helpers cache the same responses that are then returned by the sync helpers."""
+    library_page = get_library(get_user_id(stub_api.username))
+    anime_link = library_page['data'][0]['relationships']['anime']['links']['related']
+
+    anime = asyncio.run(get_anime_async(anime_link))  # act
+
+    stream_link = anime['data']['relationships']['streamingLinks']['links']['related']
+    streams = asyncio.run(get_streams_async(stream_link))
+    assert len(streams['data']) > 0
+    requests = stub_api.stats['requests']
+    assert get_anime(anime_link) == anime
+    assert get_streams(stream_link) == streams
+    assert stub_api.stats['requests'] == requests
@@ -1,9 +1,249 @@
 """Test the cache_helpers.py file."""
 
-from kitsu_lib.cache_helpers import DBConnect, initialize_cache, match_url_in_cache, pretty_dump_json, store_response
+import os
+import time
+from pathlib import Path
+
+import pytest
+from kitsu_lib import cache_helpers
+from kitsu_lib.cache_helpers import (CACHE_POLICY, EXPIRED, FRESH, MEMORY_CACHE, STALE, WRITE_BATCH, CachePolicy,
+                                     DBConnect, MemoryCache, initialize_cache, load_response, match_url_in_cache,
+                                     migrate_files_to_blobs, pretty_dump_json, reconcile_files, store_response,
+                                     touch_response, write_file_atomic)
+
+from .configuration import TEMP_DIR
 
 # class DBConnect:
+# class WriteBatch:
 # def pretty_dump_json(filename, obj):
+# def write_file_atomic(filename, payload):
+# def remove_orphans(filenames):
+# def reconcile_files(force=False):
 # def initialize_cache():
+# def migrate_files_to_blobs(remove_files_after=True):
 # def match_url_in_cache(url):
-# def store_response(prefix, url, obj):
+# def load_response(row):
+# def touch_response(url):
+# def store_response(prefix, url, obj, replace=False, validators=None):
+
+
+def test_memory_cache_lru():
+    """Verify that the least recently used entries are evicted by count and by size."""
+    cache = MemoryCache(max_entries=2, max_bytes=100)
+    cache.put('a', {'id': 'a'}, 10)
+    cache.put('b', {'id': 'b'}, 10)
+    cache.get('a')
+
+    cache.put('c', {'id': 'c'}, 10)  # act
+
+    assert cache.get('b') is None
+    assert cache.get('a') == {'id': 'a'}
+    cache.put('d', {'id': 'd'}, 95)
+    assert cache.stats == {'hits': 2, 'misses': 1, 'evictions': 3, 'entries': 1, 'bytes': 95}
+    cache.put('e', {'id': 'e'}, 101)
+    assert cache.get('e') is None
+
+
+def test_cache_policy_freshness():
+    """Verify that responses are fresh for the TTL of the prefix, then stale, then expired."""
+    policy = CachePolicy(ttl={'anime': 60}, stale_while_revalidate=60)
+    now = time.time()
+
+    result = policy.freshness('anime', now - 30)  # act
+
+    assert result == FRESH
+    assert policy.freshness('anime', now - 90) == STALE
+    assert policy.freshness('anime', now - 150) == EXPIRED
+    assert policy.freshness('unknown-prefix', 0) == FRESH
+
+
+def test_write_file_atomic():
+    """Verify that the file is replaced without leaving the temporary file behind."""
+    filename = TEMP_DIR / 'atomic.json'
+    filename.write_bytes(b'{"old": true}')
+
+    write_file_atomic(filename, b'{"new": true}')  # act
+
+    assert filename.read_bytes() == b'{"new": true}'
+    assert not (TEMP_DIR / 'atomic.json.tmp').exists()
+
+
+def test_db_connect_pragmas():
+    """Verify that the default pragmas and overrides are applied to new connections."""
+    database = DBConnect(TEMP_DIR / 'pragmas.db', pragmas={'synchronous': 'full', 'mmap_size': None})
+
+    db = database.db  # act
+
+    assert [*db.query('PRAGMA journal_mode')][0]['journal_mode'] == 'wal'
+    assert [*db.query('PRAGMA synchronous')][0]['synchronous'] == 2
+    assert [*db.query('PRAGMA mmap_size')][0]['mmap_size'] == 0
+
+
+def test_reconcile_files(kitsu_cache, monkeypatch):
+    """Verify that rows are removed for files that were deleted outside of the cache helpers."""
+    monkeypatch.setattr(CACHE_POLICY, 'storage', 'files')
+    urls = [f'https://kitsu.io/api/edge/anime/{idx}' for idx in range(3)]
+    for url in urls:
+        store_response('anime', url, {'data': {'id': url}})
+    Path(match_url_in_cache(urls[1])[0]['filename']).unlink()
+
+    count = reconcile_files()  # act
+
+    assert count == 1
+    assert match_url_in_cache(urls[1]) == []
+    assert [len(match_url_in_cache(url)) for url in (urls[0], urls[2])] == [1, 1]
+
+
+def test_reconcile_files_unchanged(kitsu_cache, monkeypatch):
+    """Verify that the directory is not listed when the generation marker is unchanged."""
+    monkeypatch.setattr(CACHE_POLICY, 'storage', 'files')
+    store_response('anime', 'https://kitsu.io/api/edge/anime/1', {'data': {}})
+    reconcile_files()
+
+    def scandir(path):
+        raise AssertionError(f'Unexpected listing of {path}')
+    monkeypatch.setattr(os, 'scandir', scandir)
+
+    count = reconcile_files()  # act
+
+    assert count == 0
+    with pytest.raises(AssertionError, match='Unexpected listing'):
+        reconcile_files(force=True)
+
+
+def test_write_batch_visible(kitsu_cache):
+    """Verify that buffered rows are returned and updated before they are committed when `batched()` exits."""
+    url = 'https://kitsu.io/api/edge/anime/1'
+    table = cache_helpers.FILE_DATA.db.load_table('files')
+
+    with WRITE_BATCH.batched(max_rows=10):
+        store_response('anime', url, {'data': {'id': '1'}})  # act
+        rows = match_url_in_cache(url)
+        timestamp = touch_response(url)
+        assert table.count() == 0
+        assert [row['url'] for row in rows] == [url]
+        assert WRITE_BATCH.rows[url]['timestamp'] == timestamp
+
+    assert WRITE_BATCH.rows == {}
+    assert [row['timestamp'] for row in table.find(url=url)] == [timestamp]
+    assert load_response(match_url_in_cache(url)[0]) == {'data': {'id': '1'}}
+
+
+def test_write_batch_stale_files(kitsu_cache, monkeypatch):
+    """Verify that the file of a replaced row is only removed after the new row is committed."""
+    monkeypatch.setattr(CACHE_POLICY, 'storage', 'files')
+    url = 'https://kitsu.io/api/edge/anime/1'
+    store_response('anime', url, {'data': {'id': 'old'}})
+    old_filename = Path(match_url_in_cache(url)[0]['filename'])
+
+    with WRITE_BATCH.batched(max_rows=10):
+        store_response('anime', url, {'data': {'id': 'new'}}, replace=True)  # act
+        assert old_filename.is_file()
+
+        assert WRITE_BATCH.flush() == 1
+        assert not old_filename.is_file()
+    rows = match_url_in_cache(url)
+    assert len(rows) == 1
+    assert load_response(rows[0]) == {'data': {'id': 'new'}}
+
+
+def test_reconcile_files_orphans(kitsu_cache, monkeypatch):
+    """Verify that old files without a row are removed, but not recent files or the files of buffered rows."""
+    monkeypatch.setattr(CACHE_POLICY, 'storage', 'files')
+    store_response('anime', 'https://kitsu.io/api/edge/anime/1', {'data': {}})
+    response_dir = cache_helpers.RESPONSE_DIR
+    orphan = response_dir / 'anime_orphan.json.tmp'
+    orphan.write_bytes(b'{}')
+    recent = response_dir / 'anime_recent.json'
+    recent.write_bytes(b'{}')
+
+    with WRITE_BATCH.batched(max_rows=10):
+        store_response('anime', 'https://kitsu.io/api/edge/anime/2', {'data': {}})
+        old = time.time() - 2 * cache_helpers.ORPHAN_MIN_AGE
+        for filename in response_dir.iterdir():
+            if filename != recent:
+                os.utime(filename, (old, old))
+
+        count = reconcile_files(force=True)  # act
+
+        assert count == 0
+        assert not orphan.is_file()
+        assert recent.is_file()
+        assert len([*response_dir.iterdir()]) == 3
+
+
+def _store_legacy(name, url, obj, timestamp):
+    """Store the response as an indented JSON file like older versions (see `legacy_cache`)."""  # noqa: DAR101,DAR201
+    filename = cache_helpers.CACHE_DIR / f'{name}.json'
+    pretty_dump_json(filename, obj)
+    cache_helpers.FILE_DATA.db.load_table('files').insert({'filename': str(filename), 'url': url,
+                                                           'timestamp': timestamp})
+    return filename
+
+
+def test_initialize_cache_duplicates(legacy_cache):
+    """Verify that only the newest row is kept for each URL before the unique index is created."""
+    url = 'https://kitsu.io/api/edge/anime/1'
+    old_filename = _store_legacy('anime_old', url, {'data': {'id': 'old'}}, 100)
+    new_filename = _store_legacy('anime_new', url, {'data': {'id': 'new'}}, 200)
+    _store_legacy('anime_other', 'https://kitsu.io/api/edge/anime/2', {'data': {'id': '2'}}, 100)
+
+    initialize_cache()  # act
+
+    rows = match_url_in_cache(url)
+    assert [row['filename'] for row in rows] == [str(new_filename)]
+    assert not old_filename.is_file()
+    assert len(match_url_in_cache('https://kitsu.io/api/edge/anime/2')) == 1
+    indexes = {row['name']: row['unique'] for row in cache_helpers.FILE_DATA.db.query("PRAGMA index_list('files')")}
+    assert indexes['ix_files_url'] == 1
+
+
+def test_store_response_replace(kitsu_cache):
+    """Verify that replacing a response updates the single row for the URL."""
+    url = 'https://kitsu.io/api/edge/anime/1'
+    store_response('anime', url, {'data': {'id': 'old'}})
+
+    store_response('anime', url, {'data': {'id': 'new'}}, replace=True)  # act
+
+    rows = match_url_in_cache(url)
+    assert len(rows) == 1
+    assert cache_helpers.FILE_DATA.db.load_table('files').count() == 1
+    MEMORY_CACHE.clear()
+    assert load_response(rows[0]) == {'data': {'id': 'new'}}
+    with pytest.raises(RuntimeError, match='Already have an entry'):
+        store_response('anime', url, {'data': {'id': 'duplicate'}})
+
+
+@pytest.mark.parametrize('storage', ['blob', 'files'])
+def test_store_response_round_trip(kitsu_cache, monkeypatch, storage):
+    """Verify that a response can be loaded from each storage backend after the memory cache is cleared."""
+    monkeypatch.setattr(CACHE_POLICY, 'storage', storage)
+    url = 'https://kitsu.io/api/edge/anime/1'
+    obj = {'data': {'id': '1', 'attributes': {'canonicalTitle': 'Cowboy Bebop', 'episodeCount': 26}}}
+    store_response('anime', url, obj, validators={'etag': '"abc"'})
+    MEMORY_CACHE.clear()
+
+    result = load_response(match_url_in_cache(url)[0])  # act
+
+    assert result == obj
+    row = match_url_in_cache(url)[0]
+    assert row['etag'] == '"abc"'
+    assert (row['body'] is None) == (storage == 'files')
+    assert (row['filename'] is None) == (storage == 'blob')
+
+
+def test_migrate_files_to_blobs(legacy_cache):
+    """Verify that responses cached as indented JSON files by older versions are moved into the database."""
+    objs = {f'https://kitsu.io/api/edge/anime/{idx}': {'data': {'id': str(idx)}} for idx in range(3)}
+    filenames = [_store_legacy(f'anime_{idx}', url, obj, 100) for idx, (url, obj) in enumerate(objs.items())]
+
+    count = migrate_files_to_blobs()  # act
+
+    assert count == 3
+    assert not any(filename.is_file() for filename in filenames)
+    MEMORY_CACHE.clear()
+    for url, obj in objs.items():
+        row = match_url_in_cache(url)[0]
+        assert row['filename'] is None
+        assert load_response(row) == obj
+    assert migrate_files_to_blobs() == 0
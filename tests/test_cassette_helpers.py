@@ -0,0 +1,85 @@
+"""Test the cassette_helpers.py file."""
+
+import json
+
+import pytest
+from kitsu_lib.cassette_helpers import CassetteAdapter, cassette_key
+from kitsu_lib.session_helpers import SessionConnect
+from kitsu_lib.stub_server import KitsuStubServer
+from requests.adapters import BaseAdapter
+
+from .configuration import TEMP_DIR, TEST_DATA_DIR
+
+USER_URL = 'https://kitsu.io/api/edge/users?filter[name]=KyleKing'
+
+
+class _LiveAdapter(BaseAdapter):
+    """Transport adapter that answers every request from a prepared cassette and counts the calls."""
+
+    def __init__(self, cassette):  # noqa: D107
+        super().__init__()
+        self.cassette = cassette
+        self.calls = 0
+
+    def send(self, request, **kwargs):  # noqa: D102
+        self.calls += 1
+        return self.cassette.send(request, **kwargs)
+
+    def close(self):  # noqa: D102
+        pass
+
+
+def test_cassette_key():
+    """Verify that equivalent URLs share the same key."""
+    result = cassette_key('get', USER_URL + '&page[limit]=5')  # act
+
+    assert result == cassette_key('GET', 'https://kitsu.io/api/edge/users?page%5Blimit%5D=5&filter%5Bname%5D=KyleKing')
+
+
+def test_cassette_replay_seeded():
+    """Verify that a cassette seeded from the test data replays without network access."""
+    cassette = CassetteAdapter(mode='replay')
+    cassette.seed_files({USER_URL: TEST_DATA_DIR / 'user.json'})
+    session = SessionConnect(transport=cassette).session
+
+    resp = session.get(USER_URL, stream=True)  # act
+
+    assert resp.status_code == 200
+    assert resp.json() == json.loads((TEST_DATA_DIR / 'user.json').read_text())
+    with pytest.raises(RuntimeError):
+        session.get('https://kitsu.io/api/edge/anime/1')
+
+
+def test_cassette_record_and_save():
+    """Verify that recorded interactions are saved and can be replayed from the file."""
+    cassette_path = TEMP_DIR / 'test_cassette.json'
+    if cassette_path.is_file():
+        cassette_path.unlink()
+    live = CassetteAdapter(mode='replay')
+    live.add(USER_URL, {'data': []})
+    transport = _LiveAdapter(live)
+    http_session = SessionConnect(transport=CassetteAdapter(cassette_path, mode='auto', transport=transport))
+
+    resp = http_session.session.get(USER_URL)  # act
+
+    assert resp.json() == {'data': []}
+    http_session.session.get(USER_URL)
+    assert transport.calls == 1
+    http_session.close()
+    assert len(CassetteAdapter(cassette_path)) == 1
+
+
+def test_cassette_record_conditional():
+    """Verify that a revalidated request records the full response instead of a bodiless `304`."""
+    cassette = CassetteAdapter(mode='record')
+    http_session = SessionConnect(transport=cassette)
+    with KitsuStubServer(n_entries=1) as server:
+        url = f'{server.base_url}/anime/1000'
+        first = http_session.session.get(url)
+
+        resp = http_session.session.get(url, headers={'If-None-Match': first.headers['ETag']})  # act
+
+    assert resp.status_code == 200
+    assert server.stats == {'requests': 2, 200: 2}
+    cassette.mode = 'replay'
+    assert http_session.session.get(url).json() == first.json()
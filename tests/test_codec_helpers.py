@@ -0,0 +1,35 @@
+"""Test the codec_helpers.py file."""
+
+from json.decoder import JSONDecodeError
+
+import pytest
+from kitsu_lib.codec_helpers import JSONCodec
+
+from .configuration import TEST_DATA_DIR
+
+
+@pytest.mark.parametrize('backend', ['orjson', 'json'])
+def test_json_codec_round_trip(backend):
+    """Verify that each backend round trips a cached API response."""
+    pytest.importorskip(backend)
+    codec = JSONCodec(backend=backend)
+    obj = codec.load_file(TEST_DATA_DIR / 'anime.json')
+
+    result = codec.loads(codec.dumps(obj, indent=True))  # act
+
+    assert result == obj
+    assert codec.loads(codec.dumps(obj)) == obj
+    with pytest.raises(JSONDecodeError):
+        codec.loads(b'{"data"')
+
+
+@pytest.mark.parametrize('indent', [True, False])
+def test_json_codec_same_output(indent):
+    """Verify that both backends write identical bytes, so cache files do not depend on the installed packages."""
+    pytest.importorskip('orjson')
+    codec = JSONCodec(backend='json')
+    obj = {**codec.load_file(TEST_DATA_DIR / 'anime.json'), 'title': 'Shingeki no Kyojin (進撃の巨人)', 'empty': []}
+
+    result = codec.dumps(obj, indent=indent)  # act
+
+    assert result == JSONCodec(backend='orjson').dumps(obj, indent=indent)
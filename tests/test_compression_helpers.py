@@ -0,0 +1,43 @@
+"""Test the compression_helpers.py file."""
+
+import zlib
+
+import pytest
+from kitsu_lib.compression_helpers import CacheCompressor
+
+from .configuration import TEST_DATA_DIR
+
+
+@pytest.mark.parametrize('method', ['zstd', 'zlib', 'none'])
+def test_cache_compressor_round_trip(method):
+    """Verify that new payloads round trip and that every format can be read with any setting."""
+    if method == 'zstd':
+        pytest.importorskip('zstandard')
+    compressor = CacheCompressor(method=method)
+    data = (TEST_DATA_DIR / 'anime.json').read_bytes()
+
+    result = compressor.compress(data)  # act
+
+    assert compressor.decompress(result) == data
+    assert compressor.decompress(data) == data
+    assert compressor.decompress(zlib.compress(data)) == data
+    if method != 'none':
+        assert len(result) < len(data)
+
+
+def test_cache_compressor_dictionary():
+    """Verify that payloads compressed with a trained dictionary need the dictionary to be read."""
+    pytest.importorskip('zstandard')
+    samples = [f'{{"data":{{"id":"{idx}","type":"anime","attributes":{{"slug":"anime-{idx}"}}}}}}'.encode()
+               for idx in range(200)]
+    compressor = CacheCompressor(method='zstd')
+    dict_data = compressor.train_dictionary(samples, dict_size=1024)
+
+    result = compressor.compress(samples[0])  # act
+
+    assert compressor.decompress(result) == samples[0]
+    with pytest.raises(RuntimeError, match='dictionary'):
+        CacheCompressor(method='zstd').decompress(result)
+    reader = CacheCompressor(method='zlib')
+    reader.load_dictionary(dict_data, use=False)
+    assert reader.decompress(result) == samples[0]
@@ -0,0 +1,61 @@
+"""Test the flight_helpers.py file."""
+
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import pytest
+from kitsu_lib.flight_helpers import BackgroundRefresh, SingleFlight
+
+
+def test_single_flight_coalesces_threads():
+    """Verify that concurrent calls for the same key share a single call."""
+    flight = SingleFlight()
+    calls = []
+    lock = threading.Lock()
+
+    def slow_call():
+        with lock:
+            calls.append(1)
+        time.sleep(0.1)
+        return {'data': []}
+
+    with ThreadPoolExecutor(max_workers=4) as pool:
+        results = list(pool.map(lambda _idx: flight.run('key', slow_call), range(4)))  # act
+
+    assert len(calls) == 1
+    assert all(result is results[0] for result in results)
+    assert flight.run('key', lambda: 'new call') == 'new call'
+
+
+def test_single_flight_async_shares_errors():
+    """Verify that an exception from the leader is raised for every waiting task."""
+    flight = SingleFlight()
+
+    async def failing_call():
+        await asyncio.sleep(0.05)
+        raise RuntimeError('API unavailable')
+
+    async def gather():
+        return await asyncio.gather(*[flight.run_async('key', failing_call) for _idx in range(3)],
+                                    return_exceptions=True)
+
+    results = asyncio.run(gather())  # act
+
+    assert all(isinstance(result, RuntimeError) for result in results)
+    with pytest.raises(RuntimeError):
+        asyncio.run(flight.run_async('key', failing_call))
+
+
+def test_background_refresh_deduplicates():
+    """Verify that only one refresh per key is pending at a time."""
+    refresh = BackgroundRefresh(max_workers=1)
+    calls = []
+
+    scheduled = [refresh.submit('key', lambda: calls.append(time.sleep(0.05))) for _idx in range(3)]  # act
+
+    refresh.wait()
+    assert scheduled == [True, False, False]
+    assert len(calls) == 1
+    assert refresh.submit('key', lambda: calls.append(None))
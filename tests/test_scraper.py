@@ -1,6 +1,166 @@
 """Test the scraper.py file."""
 
-from kitsu_lib.scraper import scrape_kitsu, scrape_kitsu_unsafe
+import asyncio
+import gc
+import json
+import time
 
-# scrape_kitsu_unsafe(username=None, limit=None):
-# scrape_kitsu(username=None, limit=None):
+import pytest
+from kitsu_lib import cache_helpers, scraper, stub_server
+from kitsu_lib.api_helpers import get_library, get_user_id
+from kitsu_lib.cache_helpers import MEMORY_CACHE, WRITE_BATCH
+from kitsu_lib.scraper import (iter_library_pages, library_page_urls, scrape_kitsu, scrape_kitsu_async_unsafe,
+                               scrape_kitsu_unsafe)
+
+# scrape_kitsu_unsafe(username=None, limit=None, workers=None, compound=False, prefetch=DEFAULT_PREFETCH,
+#                     parallel_pages=None):
+# scrape_kitsu(username=None, limit=None, workers=None, compound=False, prefetch=DEFAULT_PREFETCH,
+#              parallel_pages=None):
+# scrape_kitsu_async(username=None, limit=None, concurrency=DEFAULT_CONCURRENCY, compound=False):
+
+LIBRARY_PAGES = {
+    f'page-{idx}': {'data': [idx], 'links': {'next': f'page-{idx + 1}' if idx < 4 else None}} for idx in range(5)
+}
+"""Minimal linked library pages keyed by their URL."""
+
+
+@pytest.mark.parametrize('prefetch', [0, 1, 3])
+def test_iter_library_pages(monkeypatch, prefetch):
+    """Verify that library pages are returned in order with and without prefetching."""
+    monkeypatch.setattr(scraper, 'selective_request', lambda _prefix, url: LIBRARY_PAGES[url])
+
+    pages = [*iter_library_pages(LIBRARY_PAGES['page-0'], prefetch=prefetch)]  # act
+
+    assert [page['data'][0] for page in pages] == [0, 1, 2, 3, 4]
+    assert len([*iter_library_pages(LIBRARY_PAGES['page-0'], limit=1, prefetch=prefetch)]) == 2
+
+
+def test_iter_library_pages_error(monkeypatch):
+    """Verify that an error on the prefetch thread is raised in the caller."""
+    def selective_request(_prefix, url):
+        raise RuntimeError(url)
+    monkeypatch.setattr(scraper, 'selective_request', selective_request)
+
+    pages = iter_library_pages(LIBRARY_PAGES['page-0'], prefetch=1)  # act
+
+    assert next(pages) == LIBRARY_PAGES['page-0']
+    with pytest.raises(RuntimeError, match='page-1'):
+        next(pages)
+
+
+@pytest.mark.parametrize('prefetch', [1, 2])
+def test_iter_library_pages_prefetch_bound(monkeypatch, prefetch):
+    """Verify that no more than `prefetch` pages are fetched ahead of the page being processed."""
+    fetched = []
+
+    def selective_request(_prefix, url):
+        fetched.append(url)
+        return LIBRARY_PAGES[url]
+    monkeypatch.setattr(scraper, 'selective_request', selective_request)
+
+    for index, page in enumerate(iter_library_pages(LIBRARY_PAGES['page-0'], prefetch=prefetch)):  # act
+        time.sleep(0.05)  # Give the prefetch thread time to run ahead
+
+        assert page['data'][0] == index
+        assert len(fetched) <= index + prefetch
+    assert len(fetched) == 4
+
+
+def test_library_page_urls():
+    """Verify that the remaining page URLs are computed from the total count."""
+    next_url = 'https://kitsu.io/api/edge/users/1/library-entries?page%5Blimit%5D=2&page%5Boffset%5D=2'
+    library_page = {'data': [1, 2], 'meta': {'count': 7}, 'links': {'next': next_url}}
+
+    urls = library_page_urls(library_page)  # act
+
+    assert urls == [next_url, next_url.replace('offset%5D=2', 'offset%5D=4'),
+                    next_url.replace('offset%5D=2', 'offset%5D=6')]
+    assert library_page_urls({'data': [1, 2], 'links': {'next': next_url}}) == []
+
+
+def _clear_cache():
+    """Remove the cached responses, so the next requests use the API."""
+    cache_helpers.FILE_DATA.db.load_table('files').delete()
+    MEMORY_CACHE.clear()
+
+
+def _read_summary():
+    """Return the last summary and clear the cached responses, so the next scrape uses the API."""  # noqa: DAR201
+    all_data = json.loads((scraper.CACHE_DIR / 'all_data.json').read_text())['data']
+    _clear_cache()
+    return all_data
+
+
+def test_scrape_kitsu_async(stub_api):
+    """Verify that the asyncio engine writes the same summary as the synchronous engine."""
+    scrape_kitsu_unsafe(stub_api.username)
+    expected = _read_summary()
+
+    asyncio.run(scrape_kitsu_async_unsafe(stub_api.username))  # act
+
+    assert _read_summary() == expected
+    assert len(expected) == 30
+
+
+def test_scrape_kitsu_workers(stub_api, caplog, monkeypatch):
+    """Verify that fetching the entries from worker threads keeps the library order and leaves no connections behind."""
+    scrape_kitsu_unsafe(stub_api.username)
+    expected = _read_summary()
+    stub_api.jitter = 0.01  # Vary the response time so that the requests finish out of order
+    monkeypatch.setattr(WRITE_BATCH, 'max_delay', 0)  # Commit the buffered rows from the worker threads
+
+    scrape_kitsu_unsafe(stub_api.username, workers=4)  # act
+
+    assert _read_summary() == expected
+    gc.collect()  # Connections left by the worker threads would be reset on this thread
+    assert [record.getMessage() for record in caplog.records if record.name.startswith('sqlalchemy')] == []
+
+
+def _entry_ids(pages):
+    """Return the library entry IDs of each page."""  # noqa: DAR101,DAR201
+    return [[entry['id'] for entry in page['data']] for page in pages]
+
+
+def test_iter_library_pages_parallel(stub_api, monkeypatch):
+    """Verify that pages requested by offset are returned in order and truncated by the limit."""
+    monkeypatch.setattr(stub_server, 'MAX_PAGE_LIMIT', 7)
+    library_page = get_library(get_user_id(stub_api.username))
+    expected = _entry_ids(iter_library_pages(library_page, prefetch=0))
+    _clear_cache()
+    stub_api.jitter = 0.01  # Vary the response time so that the requests finish out of order
+    requests = stub_api.stats['requests']
+
+    pages = [*iter_library_pages(library_page, parallel_pages=4)]  # act
+
+    assert _entry_ids(pages) == expected
+    assert [len(ids) for ids in expected] == [7, 7, 7, 7, 2]
+    assert stub_api.stats['requests'] == requests + 4
+    _clear_cache()
+    limited = _entry_ids(iter_library_pages(library_page, limit=2, parallel_pages=4))
+    assert limited == expected[:3]
+    assert stub_api.stats['requests'] == requests + 4 + 2
+
+
+def test_scrape_kitsu_parallel_pages(stub_api, monkeypatch):
+    """Verify that requesting the library pages by offset writes the same summary as following the 'next' links."""
+    monkeypatch.setattr(stub_server, 'MAX_PAGE_LIMIT', 7)
+    scrape_kitsu_unsafe(stub_api.username)
+    expected = _read_summary()
+
+    scrape_kitsu_unsafe(stub_api.username, parallel_pages=4)  # act
+
+    assert _read_summary() == expected
+    assert len(expected) == 30
+
+
+def test_scrape_kitsu_compound(stub_api):
+    """Verify that resolving the entries from compound library pages writes the same summary as the N+1 requests."""
+    scrape_kitsu_unsafe(stub_api.username)
+    expected = _read_summary()
+    requests = stub_api.stats['requests']
+
+    scrape_kitsu_unsafe(stub_api.username, compound=True)  # act
+
+    assert _read_summary() == expected
+    assert len(expected) == 30
+    assert stub_api.stats['requests'] - requests == 2  # The user and the single library page
@@ -0,0 +1,39 @@
+"""Test the session_helpers.py file."""
+
+from kitsu_lib.session_helpers import SessionConnect
+from requests.adapters import HTTPAdapter
+
+
+def test_session_connect_reuses_session():
+    """Verify that the same pooled session is returned until the configuration changes."""
+    http_session = SessionConnect(pool_maxsize=4)
+
+    session = http_session.session  # act
+
+    assert session is http_session.session
+    adapter = session.get_adapter('https://kitsu.io/api/edge/anime/1')
+    assert isinstance(adapter, HTTPAdapter)
+    assert adapter._pool_maxsize == 4
+    http_session.configure(pool_maxsize=8)
+    assert session is not http_session.session
+
+
+def test_session_connect_host_pool_sizes():
+    """Verify that a host-specific pool is used for matching URLs."""
+    http_session = SessionConnect(pool_maxsize=4, host_pool_sizes={'https://media.kitsu.io': 2})
+
+    session = http_session.session  # act
+
+    assert session.get_adapter('https://media.kitsu.io/anime/1.jpg')._pool_maxsize == 2
+    assert session.get_adapter('https://kitsu.io/api/edge/anime/1')._pool_maxsize == 4
+
+
+def test_session_connect_transport():
+    """Verify that a custom transport is mounted for all URLs."""
+    transport = HTTPAdapter(pool_maxsize=1)
+    http_session = SessionConnect(transport=transport)
+
+    session = http_session.session  # act
+
+    assert session.get_adapter('https://kitsu.io/api/edge/anime/1') is transport
+    assert session.get_adapter('http://localhost:8080/api/edge/anime/1') is transport
@@ -0,0 +1,33 @@
+"""Test the stub_server.py file."""
+
+import requests
+from kitsu_lib.analysis import merge_anime_info
+from kitsu_lib.api_helpers import index_included, split_library_entry
+from kitsu_lib.stub_server import KitsuStubServer
+
+
+def test_stub_server_library():
+    """Verify that the compound library document can be merged like a response from the Kitsu API."""
+    with KitsuStubServer(n_entries=12) as server:
+        user = requests.get(f'{server.base_url}/users', params={'filter[name]': server.username}).json()
+        url = f"{server.base_url}/users/{user['data'][0]['id']}/library-entries"
+        params = {'filter[kind]': 'anime', 'page[limit]': 5, 'include': 'anime,anime.categories,anime.streamingLinks'}
+
+        page = requests.get(url, params=params).json()  # act
+
+    assert page['meta']['count'] == 12
+    assert 'page%5Boffset%5D=5' in page['links']['next']
+    entry = page['data'][0]
+    anime, streams = split_library_entry(entry, index_included(page))
+    assert merge_anime_info(entry, anime, streams)['slug'] == 'stub-anime-0'
+
+
+def test_stub_server_rate_limit():
+    """Verify that requests above the rate limit receive a `429` with a `Retry-After` header."""
+    with KitsuStubServer(n_entries=1, rate_limit=2, retry_after=3) as server:
+
+        responses = [requests.get(f'{server.base_url}/anime/1000') for _idx in range(3)]  # act
+
+    assert [resp.status_code for resp in responses] == [200, 200, 429]
+    assert responses[-1].headers['Retry-After'] == '3'
+    assert server.stats == {'requests': 3, 200: 2, 429: 1}
@@ -0,0 +1,97 @@
+"""Test the throttle_helpers.py file."""
+
+import threading
+import time
+
+from kitsu_lib.throttle_helpers import CircuitBreaker, RateLimiter, RetryPolicy, parse_retry_after
+
+
+def test_parse_retry_after():
+    """Verify that both forms of the Retry-After header are parsed."""
+    assert parse_retry_after('3') == 3.0  # act
+    assert parse_retry_after(None) is None
+    assert parse_retry_after('Wed, 21 Oct 2015 07:28:00 GMT') == 0.0
+    assert parse_retry_after('soon') is None
+
+
+def test_rate_limiter_burst():
+    """Verify that a full bucket allows a burst and then queues callers at the sustained rate."""
+    limiter = RateLimiter(rate=10, burst=3)
+
+    waits = [limiter.reserve() for _idx in range(5)]  # act
+
+    assert waits[:3] == [0.0, 0.0, 0.0]
+    assert 0.05 < waits[3] <= 0.1
+    assert 0.15 < waits[4] <= 0.2
+
+
+def test_rate_limiter_adapts():
+    """Verify that throttled responses reduce the rate and successes restore it."""
+    limiter = RateLimiter(rate=10, burst=5, recovery_step=2)
+
+    limiter.penalize(retry_after=1)  # act
+
+    assert limiter.rate == 5
+    assert limiter.reserve() > 0.9
+    limiter.reward()
+    limiter.reward()
+    limiter.reward()
+    assert limiter.rate == 10
+
+
+def test_rate_limiter_pause_spacing():
+    """Verify that callers queued during a pause are spaced at the reduced rate instead of released together."""
+    limiter = RateLimiter(rate=10, burst=20)
+    limiter.penalize(retry_after=2)
+
+    waits = [limiter.reserve() for _idx in range(12)]  # act
+
+    assert 2.15 < waits[0] <= 2.2
+    for previous, wait in zip(waits, waits[1:]):
+        assert 0.19 < wait - previous < 0.21
+
+
+def test_retry_policy_delay():
+    """Verify that the jittered backoff doubles with each attempt up to the maximum delay."""
+    policy = RetryPolicy(base_delay=1, max_delay=4)
+
+    delays = [policy.delay(attempt) for attempt in range(1, 6)]  # act
+
+    for delay, limit in zip(delays, [1, 2, 4, 4, 4]):
+        assert 0 <= delay <= limit
+
+
+def test_circuit_breaker():
+    """Verify that consecutive failures open the circuit and a failure after the cooldown reopens it."""
+    breaker = CircuitBreaker(failure_threshold=2, cooldown=0.05)
+
+    breaker.record_failure()
+    breaker.record_failure()  # act
+
+    assert breaker.is_open
+    breaker.wait()
+    assert not breaker.is_open
+    breaker.record_failure()
+    assert breaker.is_open
+    breaker.wait()
+    breaker.record_success()
+    breaker.record_failure()
+    assert not breaker.is_open
+
+
+def test_circuit_breaker_single_probe():
+    """Verify that only one caller is allowed through after the cooldown until the probe succeeds."""
+    breaker = CircuitBreaker(failure_threshold=1, cooldown=0.2)
+    breaker.record_failure()
+    passed = []
+    threads = [threading.Thread(target=lambda: passed.append(breaker.wait())) for _idx in range(4)]
+
+    for thread in threads:  # act
+        thread.start()
+
+    time.sleep(0.3)
+    assert len(passed) == 1
+    breaker.record_success()
+    for thread in threads:
+        thread.join(timeout=1)
+    assert len(passed) == 4